@@ -0,0 +1,87 @@
+# benchmarks/containers.py
+
+"""Memory per cached OSRSObject, run from the repo root with
+
+    python -m benchmarks.containers
+    python -m benchmarks.containers --jsonl items.jsonl
+
+Compares against keeping every payload key as an attribute, like OSRSObject used to.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from utils.containers import OSRSObject
+
+
+class _Attrs:
+    """The old OSRSObject, every key of the payload copied onto the instance"""
+    def __init__(self, data):
+        for k, v in data['item'].items():
+            setattr(self, k, v)
+
+
+def payload(item_id: int) -> Dict[str, Any]:
+    """A detail payload shaped like the GE's, with its own strings so nothing is shared between items"""
+    return {'item': {
+        'icon': f'https://secure.runescape.com/m=itemdb_oldschool/1612777250000_obj_sprite.gif?id={item_id}',
+        'icon_large': f'https://secure.runescape.com/m=itemdb_oldschool/1612777250000_obj_big.gif?id={item_id}',
+        'id': item_id,
+        'type': 'Default',
+        'typeIcon': 'https://www.runescape.com/img/categories/Default',
+        'name': f'Item {item_id}',
+        'description': f'A description of item {item_id}, about as long as the real ones.',
+        'current': {'trend': 'neutral', 'price': f'{item_id % 900 + 100}.{item_id % 10}k'},
+        'today': {'trend': 'negative', 'price': f'- {item_id % 97}'},
+        'members': 'true' if item_id % 2 else 'false',
+        'day30': {'trend': 'positive', 'change': f'+{item_id % 13}.0%'},
+        'day90': {'trend': 'negative', 'change': f'-{item_id % 7}.0%'},
+        'day180': {'trend': 'positive', 'change': f'+{item_id % 29}.0%'},
+    }}
+
+
+def measure(build: Callable[[], List[Any]]) -> Dict[str, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    objects = build()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'objects': len(objects), 'bytes_per_item': size / max(1, len(objects)), 'seconds': elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures memory per OSRSObject against the old attribute copying")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--jsonl", help="a JSON lines file of detail payloads, synthetic ones are used if not given")
+    args = parser.parse_args()
+
+    path = args.jsonl
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(fd, 'w') as f:
+            for item_id in range(args.count):
+                f.write(json.dumps(payload(item_id)) + '\n')
+    try:
+        def load_old() -> List[_Attrs]:
+            with open(path, encoding='utf-8') as f:
+                return [_Attrs(json.loads(line)) for line in f if line.strip()]
+
+        old = measure(load_old)
+        new = measure(lambda: OSRSObject.from_jsonl(path))
+    finally:
+        if args.jsonl is None:
+            os.remove(path)
+
+    for label, result in (('attributes', old), ('OSRSObject', new)):
+        print(f"{label:<11} {result['objects']:>7} items  {result['bytes_per_item']:8.0f} B/item  load {result['seconds'] * 1000:8.1f} ms")
+    print(f"{old['bytes_per_item'] / new['bytes_per_item']:.1f}x less memory per item")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# benchmarks/image_funcs.py
+
+"""Offline benchmarks for utils/image_funcs, run from the repo root with
+
+    python -m benchmarks.image_funcs --out bench.json
+    python -m benchmarks.image_funcs --out new.json --compare bench.json
+
+Every case runs in a fresh process so the peak RSS is the case's own.
+Exits 1 if --compare finds anything slower than --threshold times the old run.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import json
+import platform
+import resource
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from utils import image_funcs
+
+SIZES = {
+    "small": (256, 256),
+    "medium": (1024, 1024),
+    "4k": (3840, 2160),
+}
+MODES = ("RGB", "RGBA", "L", "P")
+KINDS = ("photo", "flat")
+OPS = {
+    "shift": lambda data, other: (data, "bands", 1),
+    "jpeg": lambda data, other: (data, 50, 1),
+    "jpeg_gif": lambda data, other: (data, 50, 30, image_funcs.DEFAULT_TARGET_BYTES),
+    "diff": lambda data, other: (data, other),
+    "invert": lambda data, other: (data,),
+    "poster": lambda data, other: (data, 3),
+    "filter": lambda data, other: (data, "emboss"),
+    "rotate": lambda data, other: (data, 45),
+    "pipe": lambda data, other: (data, image_funcs.parse_pipeline("invert | poster 3 | filter emboss | rotate 90")),
+}
+
+
+def make_image(size: Tuple[int, int], mode: str, kind: str, seed: int = 0) -> bytes:
+    """A synthetic upload, encoded the way someone would likely post it"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    if kind == "photo":
+        # smooth gradients with noise on top, compresses about like a real photo
+        y, x = np.mgrid[0:height, 0:width]
+        base = np.stack([x * 255 // max(1, width - 1), y * 255 // max(1, height - 1), (x + y) * 255 // max(1, width + height - 2)], axis=-1)
+        pixels = np.clip(base + rng.normal(0, 20, base.shape), 0, 255).astype(np.uint8)
+    else:
+        # big blocks of a handful of colours, like a meme or a screenshot
+        colours = rng.integers(0, 256, (8, 3), dtype=np.uint8)
+        blocks = rng.integers(0, 8, (max(1, height // 64) + 1, max(1, width // 64) + 1))
+        pixels = colours[blocks.repeat(64, axis=0).repeat(64, axis=1)[:height, :width]]
+
+    image_obj = Image.fromarray(pixels, "RGB")
+    if mode == "RGBA":
+        image_obj.putalpha(Image.linear_gradient("L").resize(size))
+    elif mode != "RGB":
+        image_obj = image_obj.convert(mode)
+
+    out_file = BytesIO()
+    if kind == "photo" and mode in ("RGB", "L"):
+        image_obj.save(out_file, format="JPEG", quality=90)
+    else:
+        image_obj.save(out_file, format="PNG")
+    return out_file.getvalue()
+
+
+def run_case(op: str, data: bytes, other: bytes, repeat: int) -> Dict[str, Any]:
+    """Runs in its own process, times decode on its own and then the whole op with encode"""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_size = image_funcs.WORKING_SIZES.get(op)
+
+    decode_times, walls, cpus, encode_times = [], [], [], []
+    info = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        image_funcs._open(data, max_size).load()
+        decode_times.append(time.perf_counter() - start)
+
+        start, cpu_start = time.perf_counter(), time.process_time()
+        out, info = image_funcs._render(op, None, *OPS[op](data, other))
+        walls.append(time.perf_counter() - start)
+        cpus.append(time.process_time() - cpu_start)
+        encode_times.append(info["encode_time"])
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "wall": statistics.median(walls),
+        "cpu": statistics.median(cpus),
+        "decode": statistics.median(decode_times),
+        "encode": statistics.median(encode_times),
+        "peak_rss_kb": rss_after,
+        "rss_growth_kb": rss_after - rss_before,
+        "output_format": info.get("format"),
+        "output_bytes": len(out),
+    }
+
+
+def run(sizes: List[str], modes: List[str], kinds: List[str], ops: List[str], repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    for size_name in sizes:
+        for mode in modes:
+            for kind in kinds:
+                data = make_image(SIZES[size_name], mode, kind, seed=0)
+                other = make_image(SIZES[size_name], mode, kind, seed=1)
+                for op in ops:
+                    with ProcessPoolExecutor(max_workers=1) as pool:
+                        result = pool.submit(run_case, op, data, other, repeat).result()
+                    result.update(case=f"{op}/{size_name}/{mode}/{kind}", input_bytes=len(data))
+                    results.append(result)
+                    print(f"{result['case']:<28} wall {result['wall'] * 1000:8.1f} ms  cpu {result['cpu'] * 1000:8.1f} ms  "
+                          f"rss {result['peak_rss_kb'] / 1024:7.1f} MB  -> {result['output_format']} {result['output_bytes'] / 1024:.0f} KB")
+    return results
+
+
+def compare(old: List[Dict[str, Any]], new: List[Dict[str, Any]], threshold: float) -> List[str]:
+    """Cases whose wall time, cpu time or peak RSS went up by more than threshold times"""
+    previous = {result["case"]: result for result in old}
+    regressions = []
+    for result in new:
+        before = previous.get(result["case"])
+        if not before:
+            continue
+        for metric in ("wall", "cpu", "peak_rss_kb"):
+            if before[metric] and result[metric] > before[metric] * threshold:
+                regressions.append(f"{result['case']}: {metric} {before[metric]:.4g} -> {result[metric]:.4g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the image_funcs operations on synthetic images")
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--kinds", nargs="+", default=list(KINDS), choices=KINDS)
+    parser.add_argument("--ops", nargs="+", default=list(OPS), choices=list(OPS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", help="an earlier --out file to check for regressions against")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.modes, args.kinds, args.ops, args.repeat)
+    with open(args.out, "w") as f:
+        json.dump({
+            "created": time.time(),
+            "python": platform.python_version(),
+            "pillow": Image.__version__,
+            "numpy": np.__version__,
+            "repeat": args.repeat,
+            "results": results,
+        }, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f)["results"], results, args.threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
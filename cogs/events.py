@@ -1,28 +1,39 @@
 # cogs/events.py
 
-from functools import lru_cache
-import traceback
+import time
+from typing import Tuple
 
+import discord
 from discord.ext import commands
 
 from utils.converters import ExceptionConverter
+from utils.errors import ErrorEntry, ErrorTracker
 
 
 class Events(commands.Cog):
+    user_errors = (
+        commands.UserInputError,
+        commands.CheckFailure,
+        commands.CommandOnCooldown,
+        commands.CommandNotFound,
+        commands.MaxConcurrencyReached,
+    )
+
     def __init__(self, bot):
         self.bot = bot
-        self._ignored = bot._ignored or {commands.CommandNotFound,}
+        self._ignored = list(bot._ignored or (commands.CommandNotFound,))
+        self.tracker = ErrorTracker()
 
     async def cog_check(self, ctx):
         print('aaaa')
         return True
 
-    @lru_cache(maxsize=3)
-    def traceback_formatter(self, exc: Exception) -> str:
-        tb = traceback.format_exception(type(exc), exc, exc.__traceback__)
-        if self.bot._print_exc:
-            print(tb)
-        return '\n'.join(tb[-2:])
+    def traceback_formatter(self, exc: Exception, where: str = '') -> Tuple[ErrorEntry, str]:
+        """Records the error, only the first of each kind gets its whole traceback printed"""
+        entry, new = self.tracker.record(exc, where)
+        if new and self.bot._print_exc:
+            print(entry.first_traceback)
+        return entry, f'{entry.name}: {exc}'[:1900] + (f' (seen {entry.count} times)' if entry.count > 1 else '')
 
     @commands.group(invoke_without_command=True)
     async def ignored(self, ctx: commands.Context):
@@ -47,17 +58,83 @@ class Events(commands.Cog):
     async def on_command_error(self, ctx: commands.Context, exc: commands.CommandError):
         if hasattr(ctx.command, 'on_error'): return
 
-        if isinstance(exc, self._ignored): return
-
-        exc = getattr(exc, 'original', exc)
+        if isinstance(exc, tuple(self._ignored)): return
 
         if isinstance(exc, commands.CommandOnCooldown):
-            if ctx.author.id == bot.owner_id:
+            if ctx.author.id == self.bot.owner_id:
                 return await ctx.reinvoke()
 
-        #exc_info = self.traceback_formatter(exc)
-        exc_info = traceback.format_exception(type(e), e, e.__traceback__)[0]
-        return await ctx.send(exc_info)
+        if isinstance(exc, self.user_errors):  # bad input, failed checks and the like are for the user to fix
+            return await ctx.send(str(exc))
+
+        # anything else (a crash, the GE being down, a worker backlog) is counted and rate limited,
+        # so an outage doesn't post the same failure to every channel that tries a command
+        original = exc.original if isinstance(exc, commands.CommandInvokeError) else exc
+        entry, exc_info = self.traceback_formatter(original, ctx.command.qualified_name if ctx.command else '')
+        if not self.tracker.should_report(entry):
+            return
+        return await ctx.send(exc_info if original is not exc else str(exc))
+
+    @commands.group(name='errors', invoke_without_command=True)
+    @commands.is_owner()
+    async def _errors(self, ctx: commands.Context, limit: int = 5):
+        """Shows the errors that have come up the most"""
+        top = self.tracker.top(limit)
+        if not top:
+            return await ctx.send('No errors so far')
+        now = time.time()
+        e = discord.Embed(title=f'{self.tracker.total} errors, {len(self.tracker)} kinds', colour=discord.Colour.red())
+        for entry in top:
+            when, where, message = entry.samples[-1]
+            e.add_field(
+                name=f'{entry.name} x{entry.count} ({entry.fingerprint[:8]})',
+                value=f'last {now - when:.0f}s ago in {where or "?"}, {entry.suppressed} reports held back\n{message[:200] or "no message"}',
+                inline=False,
+            )
+        return await ctx.send(embed=e)
+
+    @_errors.command(name='show')
+    @commands.is_owner()
+    async def _errors_show(self, ctx: commands.Context, fingerprint: str):
+        """Shows the traceback from the first time an error came up"""
+        entry = self.tracker.find(fingerprint)
+        if entry is None:
+            raise commands.BadArgument(f'No single error matches {fingerprint}')
+        return await ctx.send(f'```py\n{entry.first_traceback[-1900:]}\n```')
+
+    @_errors.command(name='clear')
+    @commands.is_owner()
+    async def _errors_clear(self, ctx: commands.Context):
+        self.tracker.clear()
+        return await ctx.send('Cleared the error log')
+
+    @commands.command(name='stats')
+    @commands.is_owner()
+    async def _stats(self, ctx: commands.Context, limit: int = 5):
+        """Which commands are slowest, how laggy the event loop is, and the worker and http stats"""
+        metrics = self.bot.metrics
+        e = discord.Embed(title='Bot stats', colour=discord.Colour.blurple())
+        e.add_field(
+            name='Event loop lag',
+            value=f'last {metrics.last_lag * 1000:.1f} ms, p95 {metrics.lag.quantile(0.95) * 1000:.0f} ms, max {metrics.lag.max * 1000:.0f} ms',
+            inline=False,
+        )
+
+        lines = []
+        for command, total in metrics.slowest(limit):
+            phases = ', '.join(
+                f'{phase} {metrics.commands[(command, phase)].mean * 1000:.0f}'
+                for phase in ('convert', 'handler', 'upload', 'worker') if (command, phase) in metrics.commands
+            )
+            lines.append(f'**{command}** x{total.count}: p95 {total.quantile(0.95) * 1000:.0f} ms, mean ms {phases}')
+        e.add_field(name='Slowest commands', value='\n'.join(lines) or 'Nothing run yet', inline=False)
+
+        for source, values in metrics.read_gauges().items():
+            if values:
+                text = '\n'.join(f'{key}: {value:.3g}' if isinstance(value, float) else f'{key}: {value}' for key, value in values.items())
+                e.add_field(name=source.title(), value=text[:1024], inline=False)
+        e.add_field(name='Errors', value=', '.join(f'{key} {value}' for key, value in self.tracker.stats().items()), inline=False)
+        return await ctx.send(embed=e)
 
 def setup(bot):
     bot.add_cog(Events(bot))
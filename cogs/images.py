@@ -1,22 +1,111 @@
 # cogs/images.py
 
-from functools import lru_cache
 from io import BytesIO, StringIO
-import time
-from typing import Optional, Tuple, Union
+from typing import Any, Dict, Optional, Tuple, Union
 
+import discord
 from discord.ext import commands
-from matplotlib import pyplot as plt
-import numpy as np
-from PIL import Image, ImageChops, ImageFilter, ImageOps
+from PIL import Image
 
-from utils.converters import LinkConverter
+import config
+from utils.converters import LinkConverter, PipelineConverter, ShiftModeConverter
 from utils import image_funcs
+from utils.cache import AvatarCache, ResultCache
+from utils.workers import WorkerPool
+
+
+async def _get_avatar(ctx, avatars: Optional[AvatarCache] = None) -> BytesIO:
+    if avatars:
+        return BytesIO(await avatars.get(ctx.author))
+    return BytesIO(await ctx.author.avatar_url_as(format="png", size=128).read())
+
+async def _get_image(ctx, index: int = 0, avatars: Optional[AvatarCache] = None) -> Tuple[BytesIO, str, Tuple[int, int]]:
+    attachment_file = BytesIO()
+
+    if not ctx.message.attachments:
+        attachment_file = await _get_avatar(ctx, avatars)
+        filename = ctx.author.display_name + ".png"
+        file_size = (128, 128)
+
+    else:
+        target = ctx.message.attachments[index]
+        await target.save(attachment_file)
+        filename = target.filename
+        file_size = (target.width, target.height)
+
+    return attachment_file, filename, file_size
+
+def _get_dimension(img_bytes: BytesIO) -> Tuple[BytesIO, Tuple[int, int]]:
+    image_obj = Image.open(img_bytes)
+    file_size = image_obj.size
+    return img_bytes, file_size
+
+async def _image_ops_func(ctx, img_bytes: Tuple[BytesIO, Optional[BytesIO]], avatars: Optional[AvatarCache] = None):
+    if len(ctx.message.attachments) == 1:
+        file_a, _, file_size = await _get_image(ctx, 0)
+
+    elif img_bytes:
+        file_a, file_size = _get_dimension(img_bytes[0])
+
+    else:
+        file_a = await _get_avatar(ctx, avatars)
+        file_size = (128, 128)
+
+    return file_a, file_size
 
 
 class Images(commands.Cog):
+    max_generations = 500
+
     def __init__(self, bot):
         self.bot = bot
+        self.worker = WorkerPool(max_workers=2, max_queued=20, timeout=30.0)
+        self.cache = ResultCache(
+            max_bytes=getattr(config, 'IMAGE_CACHE_BYTES', 64 * 1024 * 1024),
+            directory=getattr(config, 'IMAGE_CACHE_DIR', None),
+        )
+        self.avatars = AvatarCache(max_bytes=getattr(config, 'AVATAR_CACHE_BYTES', 16 * 1024 * 1024))
+
+    def cog_unload(self):
+        self.worker.close()
+
+    @staticmethod
+    def queue_key(ctx: commands.Context) -> int:
+        return ctx.guild.id if ctx.guild else ctx.channel.id
+
+    @staticmethod
+    def upload_limit(ctx: commands.Context) -> int:
+        """Biggest file we should send here, leaving some room for the rest of the request"""
+        limit = ctx.guild.filesize_limit if ctx.guild else image_funcs.DEFAULT_TARGET_BYTES
+        return limit - 256 * 1024
+
+    async def run_job(self, ctx: commands.Context, op: str, *args, cache: bool = True) -> Tuple[BytesIO, Dict[str, Any]]:
+        """Queues image_funcs.OPERATIONS[op](*args) on the image workers and waits for the encoded output
+
+        Results are cached on a digest of the input bytes and args, pass cache=False for random output"""
+        target_bytes = self.upload_limit(ctx)
+        key = ResultCache.make_key(op, target_bytes, *args) if cache else None
+        if key:
+            result = await self.cache.fetch(key)
+            if result is not None:
+                info = {'format': image_funcs._sniff_format(result[:12]), 'size': len(result), 'encode_time': 0.0, 'run_time': 0.0}
+                return BytesIO(result), info
+
+        job = self.worker.submit(self.queue_key(ctx), image_funcs._render, op, target_bytes, *args, owner=ctx.author.id)
+        if job.position:
+            await ctx.send(f'Queued, {job.position} job(s) ahead of yours.')
+        async with ctx.typing():
+            result, info = await job
+
+        if key:
+            await self.cache.store(key, result)
+        info['run_time'] = job.run_time
+        return BytesIO(result), info
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        if before.avatar != after.avatar:
+            await self.avatars.prefetch(after)
 
     async def embed_bytes(
         self,
@@ -25,102 +114,99 @@ class Images(commands.Cog):
         fileout: Union[BytesIO, StringIO],
         filename: str,
         timediff: float,
+        info: Optional[Dict[str, Any]] = None,
     ):
         f = discord.File(fileout, filename)
         e = discord.Embed(title=message, colour=discord.Colour.random())
         e.set_image(url=f'attachment://{filename}')
+        if info:
+            e.set_footer(text=f"{info['format']}, {info['size'] / 1024:.0f} KB, took {timediff * 1000:.0f} ms, encoding {info['encode_time'] * 1000:.0f} ms of it")
+        if timediff and hasattr(self.bot, 'metrics'):
+            self.bot.metrics.observe(ctx.command.qualified_name, 'worker', timediff)
         await ctx.send(embed=e, file=f)
 
     @commands.command()
     @commands.cooldown(1, 5, commands.BucketType.user)
-    @commands.max_concurrency(1, commands.BucketType.guild, wait=False)
-    async def shift(self, ctx: commands.Context, *image_bytes: Optional[LinkConverter]):
-        """Shifts the RGB bands of the attachment, link or author's profile picture"""
-        fileout, filesize = await image_funcs._image_ops_func(ctx, image_bytes)
+    async def shift(
+        self,
+        ctx: commands.Context,
+        mode: Optional[ShiftModeConverter] = "bands",
+        seed: Optional[int] = None,
+        *image_bytes: Optional[LinkConverter]
+    ):
+        """Shifts the RGB bands of the attachment, link or author's profile picture
+
+        Modes are bands, rows, columns and wrap, passing a seed makes the shift repeatable"""
+        fileout, filesize = await _image_ops_func(ctx, image_bytes, self.avatars)
 
-        start       = time.time()
-        new_file    = image_funcs._shifter(fileout, filesize)
-        end         = time.time()
+        new_file, info = await self.run_job(ctx, "shift", fileout.getvalue(), mode, seed, cache=seed is not None)
 
-        await self.embed_bytes(ctx, 'Shifting done', fileout, 'shifted.png', end-start)
+        await self.embed_bytes(ctx, 'Shifting done', new_file, f"shifted.{info['format']}", info['run_time'], info)
 
     @commands.command()
     @commands.cooldown(1, 5, commands.BucketType.user)
-    @commands.max_concurrency(1, commands.BucketType.guild, wait=False)
     async def morejpeg(
         self,
         ctx: commands.Context,
         severity: int = 15,
+        generations: Optional[int] = 1,
         *image_bytes: Optional[LinkConverter]
     ):
-        """Adds jpeg compression proportional to the severity arg to the attachment, link or author's profile picture"""
+        """Adds jpeg compression proportional to the severity arg to the attachment, link or author's profile picture
+
+        With more than 1 generation it's recompressed that many times and sent as a gif of the decay"""
 
         if not (0 <= severity <= 100):
             raise commands.BadArgument("Severity argument must be between 0 and 100 inclusive")
+        if not (1 <= generations <= self.max_generations):
+            raise commands.BadArgument(f"Generations argument must be between 1 and {self.max_generations} inclusive")
         severity = 101 - severity
 
-        fileout = image_bytes or (await image_funcs.get_image(ctx, 0))[0]
+        fileout, filesize = await _image_ops_func(ctx, image_bytes, self.avatars)
 
-        start = time.time()
-        fileout = await self.bot.loop.run_in_executor(
-            None, image_funcs._loop_jpeg, fileout, severity, 1
-        )
-        end = time.time()
+        if generations == 1:
+            fileout, info = await self.run_job(ctx, "jpeg", fileout.getvalue(), severity, 1)
+        else:
+            fileout, info = await self.run_job(
+                ctx, "jpeg_gif", fileout.getvalue(), severity, generations, self.upload_limit(ctx)
+            )
 
-        await self.embed_bytes(ctx, "Jpegifying done", fileout, 'diff.jpg', end-start)
+        await self.embed_bytes(ctx, "Jpegifying done", fileout, f"diff.{info['format']}", info['run_time'], info)
 
 
     @commands.command()
     @commands.cooldown(1, 5, commands.BucketType.user)
-    @commands.max_concurrency(1, commands.BucketType.guild, wait=False)
     async def diff(
         self,
         ctx: commands.Context,
-        *image_bytes: Optional[LinkConverter]
+        *links: str
     ):
         """Returns the difference of two images, both must be as links or both as attachments"""
         if len(ctx.message.attachments) == 2:
-            file_a, _, file_a_size = await image_funcs._get_image(ctx, 0)
-            file_b, _, file_b_size = await image_funcs._get_image(ctx, 1)
-        elif len(image_bytes) == 2:
-            file_a, file_a_size = image_funcs._get_dimension(image_bytes[0])
-            file_b, file_b_size = image_funcs._get_dimension(image_bytes[1])
+            file_a, _, file_a_size = await _get_image(ctx, 0)
+            file_b, _, file_b_size = await _get_image(ctx, 1)
+        elif len(links) == 2:
+            file_a, file_b = await LinkConverter.fetch_many(ctx, links)
         else:
             raise commands.BadArgument("Images must both be attachments or links, not a mixture")
 
-        start   = time.time()
-        fileout = image_funcs._diff(file_a, file_a_size, file_b, file_b_size)
-        end     = time.time()
+        fileout, info = await self.run_job(ctx, "diff", file_a.getvalue(), file_b.getvalue())
 
-        await self.embed_bytes(ctx, "Difference gotten", fileout, 'diff.png', end-start)
+        await self.embed_bytes(ctx, "Difference gotten", fileout, f"diff.{info['format']}", info['run_time'], info)
 
     @commands.command(name="invert", aliases=["negative"])
     @commands.cooldown(1, 10, commands.BucketType.user)
-    @commands.max_concurrency(1, commands.BucketType.guild, wait=False)
     async def _invert(self, ctx: commands.Context, *img_bytes: Optional[LinkConverter]):
         """Inverts a uploaded image, link or the authors profile picture to negative"""
 
-        file_a, file_size = await image_funcs._image_ops_func(ctx, img_bytes)
+        file_a, file_size = await _image_ops_func(ctx, img_bytes, self.avatars)
 
-        start = time.time()
+        new_file, info = await self.run_job(ctx, "invert", file_a.getvalue())
 
-        image_obj = Image.open(file_a)
-        try:
-            image_obj = ImageOps.invert(image_obj)
-        except:
-            image_obj = image_obj.convert(mode="RGB")
-            image_obj = ImageOps.invert(image_obj)
-        new_file = BytesIO()
-        image_obj.save(new_file, format="PNG")
-        new_file.seek(0)
-
-        end = time.time()
-
-        await self.embed_file(ctx, "Inverting finished", new_file, "inverted.png", end - start)
+        await self.embed_bytes(ctx, "Inverting finished", new_file, f"inverted.{info['format']}", info['run_time'], info)
 
     @commands.command(name="poster")
     @commands.cooldown(1, 10, commands.BucketType.user)
-    @commands.max_concurrency(1, commands.BucketType.guild, wait=False)
     async def _poster(
         self, ctx: commands.Context, bits: int = 8, *img_bytes: Optional[LinkConverter]
     ):
@@ -131,27 +217,14 @@ class Images(commands.Cog):
                 "Bits argument should be between 1 and 8 inclusive"
             )
 
-        file_a, file_size = await image_funcs._image_ops_func(ctx, img_bytes)
-
-        start = time.time()
-
-        image_obj = Image.open(file_a)
-        try:
-            image_obj = ImageOps.posterize(image_obj, bits)
-        except:
-            image_obj = image_obj.convert(mode="RGB")
-            image_obj = ImageOps.posterize(image_obj, bits)
-        new_file = BytesIO()
-        image_obj.save(new_file, format="PNG")
-        new_file.seek(0)
+        file_a, file_size = await _image_ops_func(ctx, img_bytes, self.avatars)
 
-        end = time.time()
+        new_file, info = await self.run_job(ctx, "poster", file_a.getvalue(), bits)
 
-        await self.embed_file(ctx, "Postering done", new_file, "poster.png", end - start)
+        await self.embed_bytes(ctx, "Postering done", new_file, f"poster.{info['format']}", info['run_time'], info)
 
     @commands.command(name="filter")
     @commands.cooldown(1, 10, commands.BucketType.user)
-    @commands.max_concurrency(1, commands.BucketType.guild, wait=False)
     async def _filter(
         self, ctx: commands.Context, filter_type: str, *img_bytes: Optional[LinkConverter]
     ):
@@ -164,45 +237,64 @@ class Images(commands.Cog):
                 "Filter must be one of those in ImageFilter docs"
             )
 
-        file_a, file_size = await image_funcs._image_ops_func(ctx, img_bytes)
+        file_a, file_size = await _image_ops_func(ctx, img_bytes, self.avatars)
 
-        start = time.time()
+        new_file, info = await self.run_job(ctx, "filter", file_a.getvalue(), filter_type)
 
-        image_obj = Image.open(file_a)
-        try:
-            image_obj = image_obj.filter(image_funcs.FILTERS[filter_type])
-        except:
-            image_obj = image_obj.convert(mode="RGB")
-            image_obj = image_obj.filter(image_funcs.FILTERS[filter_type])
-        new_file = BytesIO()
-        image_obj.save(new_file, format="png")
-        new_file.seek(0)
-
-        end = time.time()
-
-        await self.embed_file(ctx, "Applying the filter done", new_file, "filtered.png", end - start)
+        await self.embed_bytes(ctx, "Applying the filter done", new_file, f"filtered.{info['format']}", info['run_time'], info)
 
     @commands.command(name="rotate")
     @commands.cooldown(1, 10, commands.BucketType.user)
-    @commands.max_concurrency(1, commands.BucketType.guild, wait=False)
     async def _rotate(
         self, ctx: commands.Context, degrees: int, *img_bytes: Optional[LinkConverter]
     ):
         """Rotates an attached image, link or the authors profile picture some degrees, 360 returns it to original position"""
         degrees = degrees % 360 if degrees > 360 else degrees
 
-        file_a, file_size = await image_funcs._image_ops_func(ctx, img_bytes)
+        file_a, file_size = await _image_ops_func(ctx, img_bytes, self.avatars)
+
+        fileout, info = await self.run_job(ctx, "rotate", file_a.getvalue(), degrees)
 
-        start = time.time()
+        await self.embed_bytes(ctx, "Rotationings finished", fileout, f"rotated.{info['format']}", info['run_time'], info)
 
-        image_obj = Image.open(file_a)
-        image_obj = image_obj.rotate(angle=degrees)
-        fileout = BytesIO()
-        image_obj.save(fileout, format="PNG")
-        fileout.seek(0)
-        end = time.time()
+    @commands.command(name="pipe")
+    @commands.cooldown(1, 10, commands.BucketType.user)
+    async def _pipe(
+        self, ctx: commands.Context, link: Optional[LinkConverter] = None, *, chain: PipelineConverter
+    ):
+        """Runs several operations in one go on an attached image, link or the authors profile picture
+
+        Stages are split with |, e.g. invert | poster 3 | filter emboss | rotate 90 | shift rows 42"""
+
+        file_a, file_size = await _image_ops_func(ctx, (link,) if link else (), self.avatars)
+
+        new_file, info = await self.run_job(
+            ctx, "pipe", file_a.getvalue(), chain, cache=not image_funcs._is_random(chain)
+        )
 
-        await self.embed_file(ctx, "Rotationings finished", fileout, "rotated.png", end-start)
+        await self.embed_bytes(ctx, "Pipe finished", new_file, f"piped.{info['format']}", info['run_time'], info)
+
+    @commands.command(name="queue", aliases=["iq"])
+    async def _queue(self, ctx: commands.Context):
+        """Shows how busy the image workers are"""
+        stats = self.worker.stats()
+        out = f"Waiting here: {self.worker.depth_for(self.queue_key(ctx))}\n"
+        out += f"Waiting everywhere: {stats['depth']}\n"
+        out += f"Running: {stats['running']}/{self.worker.max_workers}\n"
+        out += f"Average wait: {stats['average_wait']:.2f}s (max {stats['max_wait']:.2f}s)\n"
+        out += f"Done: {stats['completed']}, failed: {stats['failed']}, timed out: {stats['timeouts']}, rejected: {stats['rejected']}\n"
+        cache = self.cache.stats()
+        out += f"Cache: {cache['entries']} entries, {cache['bytes'] / 1024 / 1024:.1f} MB, "
+        out += f"{cache['hits']} hits, {cache['disk_hits']} disk hits, {cache['misses']} misses\n"
+        avatars = self.avatars.stats()
+        out += f"Avatars: {avatars['entries']} cached, {avatars['hits']} hits, {avatars['misses']} misses, {avatars['prefetched']} prefetched"
+        return await ctx.send(out)
+
+    @commands.command(name="cancel")
+    async def _cancel(self, ctx: commands.Context):
+        """Cancels your image commands that are still waiting in the queue"""
+        cancelled = self.worker.cancel(self.queue_key(ctx), owner=ctx.author.id)
+        return await ctx.send(f"Cancelled {cancelled} queued job(s).")
 
 def setup(bot):
-    bot.add_cog(Images(bot))
\ No newline at end of file
+    bot.add_cog(Images(bot))
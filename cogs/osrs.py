@@ -1,144 +1,172 @@
 # cogs/osrs.py
 
-from aiohttp import ClientSession
 import asyncio
-from datetime import datetime
-from functools import lru_cache
 from io import BytesIO
-from itertools import repeat
-import json
+import os
+import time
+import traceback
 from json.decoder import JSONDecodeError
-from typing import Dict, List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 from bs4 import BeautifulSoup
 import discord
 from discord.ext import commands
-from matplotlib import pyplot as plt
-import matplotlib as mpl
-from numpy.random import randint
+import numpy as np
 
+import config
 from config import USERAGENT
-from utils.containers import OSRSObject
+from utils import charts
+from utils.alerts import AlertBook
+from utils.cache import TTLCache
+from utils.charts import Series
+from utils.containers import OSRSObject, Watchlists, parse_price
+from utils.http import HTTPError
+from utils.items import ItemIndex, ValidIds, normalise
+from utils.prices import DAY_MS, PriceStore, analyse, parse_daily
+from utils.workers import WorkerPool
 
 WIKI_BASE = 'https://oldschool.runescape.wiki/w/{item}'
 DETAIL = 'https://services.runescape.com/m=itemdb_oldschool/api/catalogue/detail.json?item={item_id}'
 GRAPH = 'https://services.runescape.com/m=itemdb_oldschool/api/graph/{item_id}.json'
-TITLE = "{item}: avg={avg:,}gp, \nmax={max_price:,}gp, min={min_price:,}gp"
+DATA_DIR = getattr(config, 'OSRS_DATA_DIR', 'data')
+ITEM_INDEX = os.path.join(DATA_DIR, 'items.json')
+VALID_IDS = os.path.join(DATA_DIR, 'valid_ids.npz')
+PRICES_DIR = os.path.join(DATA_DIR, 'prices')
+DETAIL_TTL = getattr(config, 'OSRS_DETAIL_TTL', 60 * 60)  # GE prices move once a day, but not at a set time
+NAME_TTL = getattr(config, 'OSRS_NAME_TTL', 7 * 24 * 60 * 60)
+ALERTS = os.path.join(DATA_DIR, 'alerts.npy')
+ALERT_INTERVAL = getattr(config, 'OSRS_ALERT_INTERVAL', 30 * 60)
 
 class Oldschool(commands.Cog):
-    items: Dict[str, OSRSObject] = {}
     max_width = 3
+    per_channel = getattr(config, 'OSRS_WATCHLIST_PER_CHANNEL', False)
+    max_rand_attempts = 3
+    max_rand_probes = 10
+    max_item_id = 25514
+    memberships = {'any': None, 'members': True, 'p2p': True, 'f2p': False, 'free': False}
 
     def __init__(self, bot):
         self.bot = bot
-        self._session = bot._session
-        self.plt = plt
-        self.plt_dim = (1, 1)
-        self.plt.subplots(*self.plt_dim)
-
-    @property
-    def print(self):
-        if len(self.items.keys()) == 0:
-            return 'None'
-        return '\n'.join(self.items.keys())
-
-    @lru_cache(maxsize=15)
+        self.web = bot.web
+        self.index = ItemIndex.load(ITEM_INDEX)
+        self._index_dirty = False
+        self.valid_ids = ValidIds.load(VALID_IDS)
+        self.prices = PriceStore(PRICES_DIR)
+        if not len(self.valid_ids):
+            self.valid_ids.seed_from(self.index)
+        self.names = TTLCache(ttl=NAME_TTL, max_entries=512)
+        self.details = TTLCache(ttl=DETAIL_TTL, max_entries=512)
+        self.graphs = TTLCache(ttl=PriceStore.recheck_after, max_entries=512)
+        self.watchlists = Watchlists(max_lists=getattr(config, 'OSRS_MAX_WATCHLISTS', 1000))
+        self.charts = WorkerPool(max_workers=2, max_queued=10, timeout=20.0, initializer=charts.warm)
+        self.alerts = AlertBook.load(ALERTS, interval=ALERT_INTERVAL)
+        self._alerts_changed = asyncio.Event()
+        self._alert_task = bot.loop.create_task(self.alert_loop())
+
+    def watchlist_key(self, ctx: commands.Context) -> Tuple[int, Optional[int]]:
+        return ctx.author.id, ctx.channel.id if self.per_channel else None
+
     async def get_item(self, item_name: str) -> int:
+        """Resolves a name from the local index, only going to the wiki for names it's never seen"""
+        if not normalise(item_name):
+            raise commands.BadArgument('You need to give an item name')
+        item_id = self.index.resolve(item_name.replace('_', ' '))
+        if item_id is not None:
+            return item_id
+        return await self.names.get(normalise(item_name), lambda: self._wiki_item_id(item_name))
+
+    async def _wiki_item_id(self, item_name: str) -> int:
         item = item_name.replace(' ',  '_')
-        page = await self._session.get(WIKI_BASE.format(item=item))
-        page = await page.text()
+        page = await self.web.text(WIKI_BASE.format(item=item))
         soup = BeautifulSoup(page, features='html.parser')
-        return int(soup.find('div', {'class': 'GEdataprices'})['data-itemid'])
-    
-    @lru_cache(maxsize=15)
+        item_id = int(soup.find('div', {'class': 'GEdataprices'})['data-itemid'])
+        self.index.add(item_id, item_name.replace('_', ' '))
+        self._index_dirty = True
+        return item_id
+
     async def make_object(self, item_id: Union[int, str]) -> OSRSObject:
         if isinstance(item_id, str):
             item_id = await self.get_item(item_id)
             return await self.make_object(item_id)
 
         elif isinstance(item_id, int):
-            data = await self._session.get(DETAIL.format(item_id=item_id), headers=USERAGENT)
-            data = json.loads(await data.text())
-            return OSRSObject(data)
+            return await self.details.get(item_id, lambda: self._fetch_object(item_id))
 
         else:
             return None
-    
-    async def get_price_data(self, item: OSRSObject) -> dict:
-        data = await self._session.get(GRAPH.format(item_id=item.id), headers=USERAGENT)
-        return json.loads(await data.text())
-
-
-    async def make_graph(self, item: OSRSObject, graph: mpl.axes.SubplotBase):
-        data = await self.get_price_data(item)
-        dates, prices = [], []
-        for k, v in data['daily'].items():
-            dates.append(datetime.fromtimestamp(int(k)//1000))
-            prices.append(int(v))
-        graph.plot(dates, prices)
-        return graph
-
-
-    @lru_cache(maxsize=5)
-    def get_subplots(self, num_items: int):
-        if num_items > self.max_width:
-            rows, remainder = divmod(num_items, self.max_width)
-            if remainder != 0:
-                rows += 1
-            cols = self.max_width
-            start_idx = int(str(rows) + str(cols) + '1')
-            end_idx = start_idx + (num_items)
-            out = [plt.subplot(num) for num in range(start_idx, end_idx)]
-        else:
-            start_idx = int('1'+str(num_items)+'1')
-            end_idx = start_idx + num_items
-            out = [plt.subplot(num) for num in range(start_idx, end_idx)]
-        return out
 
-    
+    async def _fetch_object(self, item_id: int) -> OSRSObject:
+        try:
+            item = OSRSObject(await self.web.json(DETAIL.format(item_id=item_id), headers=USERAGENT))
+        except HTTPError as exc:
+            if exc.status == 404:
+                self.valid_ids.mark_invalid(item_id)
+            raise
+        self.valid_ids.mark_valid(item_id, price=item.price, members=item.is_members)
+        if item_id not in self.index:
+            self.index.add(item_id, item.name, members=item.is_members)
+            self._index_dirty = True
+        return item
+
+    async def get_price_data(self, item_id: int, days: Optional[int] = 180) -> np.ndarray:
+        """The item's stored daily prices over the last `days` days (all of them for None),
+        only asking the GE for new points when the newest stored one is over a day old"""
+        if self.prices.is_stale(item_id):
+            await self.graphs.get(item_id, lambda: self._refresh_prices(item_id))
+
+        series = self.prices.read(item_id)
+        if days and series.size:
+            series = series[series['t'] >= series['t'][-1] - days * DAY_MS]
+        return series
+
+    async def _refresh_prices(self, item_id: int) -> int:
+        try:
+            daily = (await self.web.json(GRAPH.format(item_id=item_id), headers=USERAGENT))['daily']
+        except (KeyError, JSONDecodeError, HTTPError):
+            if not self.prices.last_timestamp(item_id):
+                raise
+            return 0
+        return self.prices.append(item_id, *parse_daily(daily))
+
+    async def price_series(self, item_id: int, name: str) -> Series:
+        series = await self.get_price_data(item_id)
+        return name, np.array(series['t']), np.array(series['p'])
+
+    async def render(self, ctx: commands.Context, series: List[Series], filename: str, embed_title: str,
+                     separate: bool = True, title: Optional[str] = None):
+        """Draws the chart in a chart worker and sends it"""
+        key = ctx.guild.id if ctx.guild else ctx.channel.id
+        job = self.charts.submit(key, charts.render_prices, series, self.max_width, separate, title, owner=ctx.author.id)
+        plot_bytes = BytesIO(await job)
+
+        fileout = discord.File(plot_bytes, filename=filename)
+        embed = discord.Embed(title=embed_title, colour=discord.Colour.random())
+        embed.set_image(url='attachment://' + filename)
+        return await ctx.send(embed=embed, file=fileout)
+
     @commands.group(invoke_without_command=True, name='graph')
     @commands.max_concurrency(1, commands.BucketType.user, wait=False)
     async def _graph(self, ctx: commands.Context, *item_name):
         """Attempts to draw a graph of the price of an item over the last 180 days"""
         item_name = '_'.join(item_name)
-        item = await self.make_object(item_name)
-        data = (await self.get_price_data(item))['daily']
-        dates, prices = [], []
-        for k, v in data.items():
-            dates.append(datetime.fromtimestamp(int(k)//1000))
-            prices.append(int(v))
-        plt.plot(dates, prices)
-        plt.xlabel('Date')
-        plt.ylabel('Prices')
-        now = datetime.utcnow().strftime("(%d-%m)")
-        plt.title(TITLE.format(item=item.name, avg=sum(prices)//len(dates), max_price=max(prices), min_price=min(prices)))
-
-        plot_bytes = BytesIO()
-        plt.savefig(plot_bytes, format='png')
-        plot_bytes.seek(0)
-        plt.clf() # clears the self.plt figure for the next cmd
-        plt.cla()
-
-        attachment_url = item.name.replace(' ', '_') + '.png'
-        fileout = discord.File(plot_bytes, filename=attachment_url)
-        attachment_url = 'attachment://' + attachment_url
-        embed = discord.Embed(title=item.name, colour=discord.Colour.random())
-        embed.set_image(url=attachment_url)
-
-        await ctx.send(embed=embed, file=fileout)
+        async with ctx.typing():
+            item = await self.make_object(item_name)
+            series = await self.price_series(item.id, item.name)
+            await self.render(ctx, [series], item.name.replace(' ', '_') + '.png', item.name, separate=True)
         
     @_graph.command()
     async def add(self, ctx: commands.Context, *item_name):
-        """Adds an item to an existing plot """
-        if len(self.items.keys()) == 9:
-            return await ctx.send("You can't have more than 9 items per plot, here are the items in the list if you want to remove one;\n" + self.print)
+        """Adds an item to your list of items to plot"""
         item_name = '_'.join(item_name)
         item = await self.make_object(item_name)
-        print(item, item_name)
         if not item:
             return await ctx.send(f"{item_name} could not be found")
-        if not self.items.get(item.name, False):
-            self.items[item.name] = item
+        key = self.watchlist_key(ctx)
+        try:
+            added = self.watchlists.add(key, item.id, item.name)
+        except ValueError:
+            return await ctx.send(f"You can't have more than {self.watchlists.max_items} items per plot, here are the items in the list if you want to remove one;\n" + self.format_list(key))
+        if added:
             return await ctx.send(f'{item.name} added to the plots')
         return await ctx.send('Item is already in the list to show')
 
@@ -146,70 +174,61 @@ class Oldschool(commands.Cog):
     async def remove(self, ctx: commands.Context, *item_name):
         """Removes the given item name from the graphs to be plotted"""
         item_name = '_'.join(item_name)
-        item = self.make_object(item_name)
-        if not item:
-            return await ctx.send(f"{item_name} could not be found")
-        if self.items.get(item.name, False):
-            del self.items[item.name]
-            return await ctx.send(f"{item.name} removed from the plots")
-        return await ctx.send(f"{item.name} wasn't in the list of items to plot")
+        item_id = await self.get_item(item_name)
+        name = self.index.name(item_id) or item_name
+        if self.watchlists.remove(self.watchlist_key(ctx), item_id):
+            return await ctx.send(f"{name} removed from the plots")
+        return await ctx.send(f"{name} wasn't in the list of items to plot")
+
+    def format_list(self, key: Tuple[int, Optional[int]]) -> str:
+        return '\n'.join(self.watchlists.get(key).values()) or 'None'
 
     @_graph.command(name='list')
     async def _list(self, ctx: commands.Context):
         """Shows all items currently stored waiting for graphing"""
-        return await ctx.send(self.print)
+        return await ctx.send(self.format_list(self.watchlist_key(ctx)))
 
     @_graph.command()
     async def show(self, ctx: commands.Context, seperate: bool = True):
         """Constructs the actual plots"""
-        number_of_items = len(list(self.items.keys()))
+        key = self.watchlist_key(ctx)
+        items = self.watchlists.get(key)
+        if not items:
+            return await ctx.send('There aren\'t any items to plot, add some with graph add')
         async with ctx.typing():
-            if seperate:
-                axes = self.get_subplots(number_of_items)
-                newplots = await asyncio.gather(*[self.make_graph(item, axes) for item, axes in zip(list(self.items.values()), axes)])
-
-                print('Plots gotten')
-                
-                graph_bytes = BytesIO()
-                plt.savefig(graph_bytes, format='png')
-                graph_bytes.seek(0)
-                print('File saved')
-
-                _ = [plot.clear() for plot in newplots] # just a tidy up after making the graphs
-                plt.clf()
-                
-                f = discord.File(graph_bytes, filename='OSRS-items.png')
-                e = discord.Embed(title="Your graphs ;", colour=discord.Color.random())
-                e.set_image(url='attachment://OSRS-items.png')
-                print('Stuff made, ready to send')
-
-                self.items = {}
-
-                return await ctx.send(embed=e, file=f)
-            else:
-                newplots = await asyncio.gather(*[self.make_graph(item, axes) for item, axes in zip(list(self.items.values()), repeat(plt.subplot(111)))])
-                print('Plots gotten')
-
-                plt.xlabel('Date')
-                plt.ylabel('Prices')
-                plt.title(", ".join(self.items.keys()))
+            series = await asyncio.gather(*[self.price_series(item_id, name) for item_id, name in items.items()])
+            message = await self.render(ctx, list(series), 'OSRS-items.png', "Your graphs ;", separate=seperate, title=", ".join(items.values()))
+        self.watchlists.pop(key)  # only once it's been sent, so a failed render doesn't lose the list
+        return message
+
+    @_graph.command(name='stats')
+    async def _stats(self, ctx: commands.Context, *, item_names: str):
+        """Moving averages, volatility, price changes and drawdown for items, separate them with commas"""
+        names = [name.strip() for name in item_names.split(',') if name.strip()]
+        if not names:
+            raise commands.BadArgument('Give me at least one item name')
+        if len(names) > 9:
+            raise commands.BadArgument("You can't get stats for more than 9 items at once")
 
-                graph_bytes = BytesIO()
-                plt.savefig(graph_bytes, format='png')
-                graph_bytes.seek(0)
-                print('File saved')
-
-                _ = [plot.clear() for plot in newplots]
-                plt.clf()
-
-                f = discord.File(graph_bytes, filename='OSRS-items.png')
-                e = discord.Embed(title="Your graphs ;", colour=discord.Color.random())
-                e.set_image(url='attachment://OSRS-items.png')
-                print('Stuff made, ready to send')
-
-                self.items = {}
-
-                return await ctx.send(embed=e, file=f)
+        async with ctx.typing():
+            items = await asyncio.gather(*[self.make_object(name) for name in names])
+            series = await asyncio.gather(*[self.get_price_data(item.id, days=None) for item in items])
+            stats = analyse(series)
+
+        def fmt(value: float, suffix: str = '%') -> str:
+            return 'n/a' if np.isnan(value) else f'{value:+.1f}{suffix}' if suffix else f'{value:,.0f}gp'
+
+        embed = discord.Embed(title='Price stats', colour=discord.Colour.random())
+        for row, item in enumerate(items):
+            embed.add_field(name=item.name, inline=True, value='\n'.join((
+                f"Price: {fmt(stats['last'][row], '')}",
+                f"7d/30d avg: {fmt(stats['ma7'][row], '')} / {fmt(stats['ma30'][row], '')}",
+                f"7d: {fmt(stats['change7'][row])}, 30d: {fmt(stats['change30'][row])}",
+                f"90d: {fmt(stats['change90'][row])}, 180d: {fmt(stats['change180'][row])}",
+                f"Volatility: {fmt(stats['volatility'][row]).lstrip('+')} a day",
+                f"Drawdown: {fmt(stats['drawdown'][row])} max, {fmt(stats['drawdown_now'][row])} now",
+            )))
+        return await ctx.send(embed=embed)
 
     @commands.command(name='max_width', aliases=['mw'])
     async def _max_width(self, ctx: commands.Context, new_maxwidth: int):
@@ -222,17 +241,184 @@ class Oldschool(commands.Cog):
             raise commands.BadArgument('The new max width must be between 2 and 4 inclusive')
 
     @commands.command(name='randitem')
-    async def randomitem(self, ctx: commands.Context):
-        """Attempts to get a random item from the oldschool database"""
-        item_id = randint(0, 25514)
-        item = None
-        while not item:
+    async def randomitem(self, ctx: commands.Context, min_price: Optional[int] = None, max_price: Optional[int] = None, membership: str = 'any'):
+        """Gets a random item from the oldschool database, optionally between two prices and members/f2p only"""
+        membership = membership.lower()
+        if membership not in self.memberships:
+            raise commands.BadArgument(f'Membership should be one of {", ".join(self.memberships)}')
+        members = self.memberships[membership]
+        if not len(self.valid_ids):
+            return await self._probe_random(ctx, min_price, max_price, members)
+
+        for _ in range(self.max_rand_attempts):
+            item_id = self.valid_ids.sample(min_price=min_price, max_price=max_price, members=members)
+            if item_id is None:
+                return await ctx.send('No items I know of match that, try a wider price range')
             try:
                 item = await self.make_object(item_id)
-            except (KeyError, JSONDecodeError):
-                pass # just means the id wasnt a real item (a duplicate or untradeable)
-        if item:
+            except (KeyError, JSONDecodeError, HTTPError):
+                continue # a 404 means the id has gone stale, make_object has marked it invalid so it won't come up again
             return await ctx.send(item.print)
+        return await ctx.send('Couldn\'t find a valid item, try again in a bit')
+
+    async def _probe_random(self, ctx: commands.Context, min_price: Optional[int], max_price: Optional[int], members: Optional[bool]):
+        """No ids are known yet (there's no item index), so guess a few, each one that works is remembered"""
+        for _ in range(self.max_rand_probes):
+            try:
+                item = await self.make_object(int(np.random.randint(0, self.max_item_id)))
+            except (KeyError, JSONDecodeError, HTTPError):
+                continue
+            if (min_price is not None and item.price < min_price) or (max_price is not None and item.price > max_price):
+                continue
+            if members is not None and item.is_members != members:
+                continue
+            return await ctx.send(item.print)
+        return await ctx.send('Couldn\'t find a matching item, try again in a bit')
+
+    def cog_unload(self):
+        self._alert_task.cancel()
+        self.alerts.save(ALERTS)
+        self.charts.close()
+        if self._index_dirty:
+            self.index.save(ITEM_INDEX)
+        self.valid_ids.save(VALID_IDS)
+
+    async def current_price(self, item_id: int) -> Optional[int]:
+        """A fresh price straight from the GE, None if it couldn't be had"""
+        try:
+            item = await self._fetch_object(item_id)
+        except (KeyError, JSONDecodeError, HTTPError):
+            return None
+        self.details.put(item_id, item)
+        return item.price
+
+    async def alert_loop(self):
+        """Sleeps until the next item is due a check, or an alert is added, then checks every due item once"""
+        await self.bot.wait_until_ready()
+        while True:
+            self._alerts_changed.clear()
+            due = self.alerts.next_due()
+            try:
+                await asyncio.wait_for(self._alerts_changed.wait(), None if due is None else max(0.0, due - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+            items = self.alerts.due()
+            if not items:
+                continue
+            checked = set()
+            triggered = 0
+            try:
+                prices = await asyncio.gather(*[self.current_price(item_id) for item_id in items])
+                for item_id, price in zip(items, prices):
+                    checked.add(item_id)
+                    for alert in self.alerts.check(item_id, price):
+                        triggered += 1
+                        await self.notify(alert, price)
+            except Exception:
+                traceback.print_exc()
+                for item_id in items:
+                    if item_id not in checked:  # popped off the schedule but never checked, so put them back
+                        self.alerts.check(item_id, None)
+            if triggered:
+                try:
+                    self.alerts.save(ALERTS)
+                except OSError:
+                    traceback.print_exc()
+
+    async def notify(self, alert: np.void, price: int):
+        channel = self.bot.get_channel(int(alert['channel']))
+        if channel is None:
+            return
+        name = self.index.name(int(alert['item'])) or f"Item {alert['item']}"
+        direction = 'above' if alert['above'] else 'below'
+        try:
+            await channel.send(f"<@{alert['user']}> {name} is {price:,}gp, {direction} your alert at {alert['price']:,}gp")
+        except discord.HTTPException:
+            pass
+
+    @commands.group(name='alert', invoke_without_command=True)
+    async def _alert(self, ctx: commands.Context, *, args: str):
+        """Pings you here when an item goes above or below a price, like alert rune platebody below 38.5k"""
+        try:
+            item_name, direction, price = args.rsplit(' ', 2)
+            price = parse_price(price)
+        except ValueError:
+            raise commands.BadArgument('Usage: alert <item> above|below <price>')
+        direction = direction.lower()
+        if direction not in ('above', 'below'):
+            raise commands.BadArgument('Alerts are either above or below a price')
+
+        item = await self.make_object(item_name)
+        try:
+            alert_id = self.alerts.add(item.id, ctx.author.id, ctx.channel.id, price, direction == 'above')
+        except ValueError as exc:
+            raise commands.BadArgument(str(exc))
+        self._alerts_changed.set()
+        self.alerts.save(ALERTS)
+        return await ctx.send(f"Alert {alert_id} set, I'll ping you when {item.name} goes {direction} {price:,}gp")
+
+    @_alert.command(name='list')
+    async def _alert_list(self, ctx: commands.Context):
+        """Shows your alerts"""
+        alerts = self.alerts.for_user(ctx.author.id)
+        if not alerts.size:
+            return await ctx.send("You don't have any alerts")
+        return await ctx.send('\n'.join(
+            f"{alert['id']}: {self.index.name(int(alert['item'])) or alert['item']} {'above' if alert['above'] else 'below'} {alert['price']:,}gp"
+            for alert in alerts
+        ))
+
+    @_alert.command(name='remove')
+    async def _alert_remove(self, ctx: commands.Context, alert_id: int):
+        """Removes one of your alerts by its number from alert list"""
+        if not self.alerts.remove(alert_id, user_id=ctx.author.id):
+            raise commands.BadArgument(f"You don't have an alert {alert_id}")
+        self.alerts.save(ALERTS)
+        return await ctx.send(f"Alert {alert_id} removed")
+
+    @commands.command(name='reindex')
+    @commands.is_owner()
+    async def _reindex(self, ctx: commands.Context, dump_path: str):
+        """Rebuilds the item name index from a dump file, like the wiki's prices mapping"""
+        loop = asyncio.get_event_loop()
+        try:
+            index = await loop.run_in_executor(None, ItemIndex.from_dump, dump_path)
+        except (OSError, ValueError, KeyError) as exc:
+            raise commands.BadArgument(f'Couldn\'t build an index from {dump_path}: {exc}')
+        await loop.run_in_executor(None, index.save, ITEM_INDEX)
+        self.index = index
+        self._index_dirty = False
+        self.valid_ids.seed_from(index)
+        return await ctx.send(f'Indexed {len(index)} items')
+
+    @commands.command(name='warmitems')
+    @commands.is_owner()
+    async def _warm_items(self, ctx: commands.Context, path: str):
+        """Loads item details from a JSON lines file of GE detail payloads into the caches and index"""
+        loop = asyncio.get_event_loop()
+        try:
+            items = await loop.run_in_executor(None, OSRSObject.from_jsonl, path)
+        except OSError as exc:
+            raise commands.BadArgument(f'Couldn\'t read {path}: {exc}')
+        for item in items:
+            self.details.put(item.id, item)
+            self.valid_ids.mark_valid(item.id, price=item.price, members=item.is_members)
+            if item.id not in self.index:
+                self.index.add(item.id, item.name, members=item.is_members)
+                self._index_dirty = True
+        return await ctx.send(f'Loaded {len(items)} items')
+
+    @commands.command(name='itemsearch', aliases=['is'])
+    async def _itemsearch(self, ctx: commands.Context, *item_name):
+        """Shows the items the index thinks a name could mean"""
+        item_name = ' '.join(item_name)
+        if not normalise(item_name):
+            raise commands.BadArgument('You need to give an item name')
+        matches = self.index.prefix(item_name, limit=5) or self.index.fuzzy(item_name, limit=5)
+        if not matches:
+            return await ctx.send(f"Nothing in the index looks like {item_name}")
+        return await ctx.send('\n'.join(f"{self.index.name(item_id)} ({item_id})" for item_id in matches))
 
 
 def setup(bot):
@@ -1,18 +1,42 @@
 # cogs/pins.py
 
+import asyncio
 from datetime import datetime
-import aiohttp
+import os
+import re
+import time
+from urllib.parse import urlsplit
 import discord
 from discord.ext import commands
+from discord.http import Route
 import typing
 
+import config
+from utils import image_funcs
+from utils.converters import LinkConverter
+from utils.pins import Checkpoints, PinIndex, PinRecord, batch_embeds, record_from_message, records_from_archive
+from utils.workers import WorkerPool
+
+DATA_DIR = getattr(config, 'PINS_DATA_DIR', 'data')
+
 
 class Pins(commands.Cog):
+    search_limit = 5
+    emoji_download_bytes = 8 * 1024 * 1024  # anything over the emoji limit gets shrunk, this is just what's worth trying
+    backfill_batch = 500
+
     def __init__(self, bot):
         self.bot = bot
         self.pond_server = 227088162390802433
         self.gen_channel = 227088162390802433  # same because default channel
         self.pin_channel = 707925869162659960
+        self.checkpoints = Checkpoints(os.path.join(DATA_DIR, 'pin_checkpoints.json'))
+        self.index = PinIndex(os.path.join(DATA_DIR, 'pins.sqlite3'))
+        self.worker = WorkerPool(max_workers=1, max_queued=20, timeout=60.0)
+
+    def cog_unload(self):
+        self.index.close()
+        self.worker.close()
 
     def generate_embed(self, msg: discord.Message) -> discord.Embed:
         e = discord.Embed(colour=discord.Colour.random())
@@ -21,23 +45,80 @@ class Pins(commands.Cog):
         e.set_footer(text=datetime.utcnow().strftime(r"%d %b '%y; %I:%M %p"))
         return e
 
+    @staticmethod
+    def emoji_name(name: str) -> str:
+        """Discord only takes 2 to 32 letters, numbers and underscores"""
+        name = re.sub(r'\W+', '_', name).strip('_')[:32]
+        return name if len(name) >= 2 else 'emoji'
+
+    async def emoji_bytes(self, emoji: typing.Union[discord.Emoji, discord.PartialEmoji, str]) -> bytes:
+        if isinstance(emoji, str):
+            fileout = await LinkConverter.fetch(self.bot._session, emoji.strip('<>'), self.emoji_download_bytes)
+            return fileout.getvalue()
+        return await emoji.url_as().read()
+
+    async def ingest_emoji(self, ctx, emoji: typing.Union[discord.Emoji, discord.PartialEmoji, str], name: str) -> discord.Emoji:
+        """Downloads with a size cap, shrinks it in a worker if it's over the emoji limit, then adds it"""
+        emojibytes = await self.emoji_bytes(emoji)
+        try:
+            emojibytes, _ = await self.worker.submit(ctx.guild.id, image_funcs._fit_emoji, emojibytes, owner=ctx.author.id)
+        except (ValueError, OSError) as exc:
+            raise commands.BadArgument(f'Couldn\'t make an emoji out of that: {exc}')
+        return await ctx.guild.create_custom_emoji(name=self.emoji_name(name), image=emojibytes)
+
     @commands.has_role('Pathfinder')
     @commands.command()
     async def add_emoji(self, ctx, emoji: typing.Union[discord.Emoji, discord.PartialEmoji, str], *, name: typing.Optional[str]):
-        if isinstance(emoji, str):
-            async with aiohttp.ClientSession() as cs:
-                async with cs.get(emoji) as res:
-                    emojibytes = await res.read()
-        else:
-            emojibytes = await (emoji.url_as()).read()
         name = name or f'{ctx.author.display_name}\'s-emoji'
-        await ctx.guild.create_custom_emoji(name=name, image=emojibytes)
+        async with ctx.typing():
+            added = await self.ingest_emoji(ctx, emoji, name)
+        await ctx.send(f'Added {added}')
 
-    @commands.command(name='pins')
-    @commands.is_owner()
-    async def update_pins(self, ctx, target_after=None):
-        """Pulls pinned messages to the pinned messages channel to reduce overflow"""
-        general = self.bot.get_channel(self.gen_channel)
+    @commands.has_role('Pathfinder')
+    @commands.command()
+    async def add_emojis(self, ctx, *emojis: typing.Union[discord.Emoji, discord.PartialEmoji, str]):
+        """Adds several emojis at once, named after the original emoji or the file name in the link"""
+        if not emojis:
+            raise commands.BadArgument('Give me some emojis or links to add')
+
+        def source_name(emoji) -> str:
+            if isinstance(emoji, str):
+                return os.path.splitext(os.path.basename(urlsplit(emoji.strip('<>')).path))[0]
+            return emoji.name
+
+        async with ctx.typing():
+            results = await asyncio.gather(
+                *[self.ingest_emoji(ctx, emoji, source_name(emoji)) for emoji in emojis], return_exceptions=True
+            )
+        added = [str(result) for result in results if isinstance(result, discord.Emoji)]
+        failed = [f'{source_name(emoji)}: {result}' for emoji, result in zip(emojis, results) if isinstance(result, Exception)]
+        out = f"Added {' '.join(added)}" if added else 'Didn\'t add anything'
+        if failed:
+            out += '\nFailed;\n' + '\n'.join(failed)
+        await ctx.send(out[:2000])
+
+    async def unarchived(self, channel: discord.TextChannel, after: datetime) -> typing.List[discord.Message]:
+        messages = await channel.pins()
+        archived = self.checkpoints.archived(channel.id)
+        # go from oldest to newest, skipping anything too old or already archived
+        return [m for m in messages[::-1] if m.created_at >= after and m.id not in archived]
+
+    async def send_embeds(self, channel: discord.TextChannel, embeds: typing.List[discord.Embed]):
+        """Sends up to 10 embeds in one message, discord.py's http client waits out the rate limit headers"""
+        route = Route('POST', '/channels/{channel_id}/messages', channel_id=channel.id)
+        await self.bot.http.request(route, json={'embeds': [embed.to_dict() for embed in embeds]})
+
+    async def index_pins(self, records: typing.List[PinRecord]):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.index.add, records)
+
+    @commands.group(name='pins', invoke_without_command=True)
+    async def update_pins(self, ctx, channels: commands.Greedy[discord.TextChannel], target_after=None):
+        """Pulls pinned messages to the pinned messages channel to reduce overflow, from general unless channels are given.
+        Only pins that haven't been archived yet are sent, so it can be rerun after a failure"""
+        if not await self.bot.is_owner(ctx.author):  # not a check on the group, search is for everyone
+            raise commands.NotOwner('You do not own this bot.')
+        channels = channels or [self.bot.get_channel(self.gen_channel)]
         pins = self.bot.get_channel(self.pin_channel)
 
         if target_after:
@@ -47,22 +128,58 @@ class Pins(commands.Cog):
                 raise commands.BadArgument(
                     'Time passed did not match "%d:%m:%y" format.'
                 )
-            else:
-                after = datetime.strptime("16 9 18", r"%y %m %d")  # general creation date
-
-        messages = await general.pins()
-        messages: typing.List[discord.Message] = messages[::-1]  # go from oldest to newest
-        messages = [m for m in messages if m.created_at >= after]  # filter out messages by creation date
-        embeds = []
-
-        for message in messages:
-            embed = self.generate_embed(message)
-            print(f'Made embed number : {len(embeds)}')
-            embeds.append(embed)
-            try:
-                await pins.send(embed=embed)
-            except Exception as e:
-                raise e
+        else:
+            after = datetime.strptime("16 9 18", r"%y %m %d")  # general creation date
+
+        pending = await asyncio.gather(*[self.unarchived(channel, after) for channel in channels])
+        sent = 0
+        for channel, messages in zip(channels, pending):
+            done = 0
+            for batch in batch_embeds(self.generate_embed(message) for message in messages):
+                await self.send_embeds(pins, batch)
+                archived = messages[done:done + len(batch)]
+                self.checkpoints.mark(channel.id, [message.id for message in archived])
+                await self.index_pins([record_from_message(message, time.time()) for message in archived])
+                done += len(batch)
+            sent += done
+        await ctx.send(f'Archived {sent} pins from {len(channels)} channel(s)')
+
+    @update_pins.command(name='search')
+    async def search_pins(self, ctx, *, query: str):
+        """Finds archived pins by their content or author"""
+        loop = asyncio.get_event_loop()
+        results = await loop.run_in_executor(None, self.index.search, query, self.search_limit)
+        if not results:
+            return await ctx.send(f'No pins match {query}')
+
+        e = discord.Embed(title=f'Pins matching {query}'[:256], colour=discord.Colour.random())
+        for row in results:
+            content = row['content'] or row['attachments'].split('\n')[0] or '*no text*'
+            if len(content) > 200:
+                content = content[:200] + '...'
+            when = datetime.utcfromtimestamp(row['created_at']).strftime(r"%d %b '%y")
+            e.add_field(name=f"{row['author']}, {when}", value=f"{content}\n[Jump]({row['jump_url']})", inline=False)
+        await ctx.send(embed=e)
+
+    @update_pins.command(name='backfill')
+    @commands.is_owner()
+    async def backfill_pins(self, ctx, limit: typing.Optional[int] = None):
+        """Indexes pins already in the pins channel for search, from the embeds there"""
+        pins = self.bot.get_channel(self.pin_channel)
+        records, total = [], 0
+        async with ctx.typing():
+            async for message in pins.history(limit=limit, oldest_first=True):
+                if message.author != self.bot.user:
+                    continue
+                records.extend(records_from_archive(message))
+                if len(records) >= self.backfill_batch:
+                    total += len(records)
+                    await self.index_pins(records)
+                    records = []
+            if records:
+                total += len(records)
+                await self.index_pins(records)
+        await ctx.send(f'Indexed {total} archived pins, {len(self.index)} in the index')
 
     @commands.command()
     async def pin(self, ctx, msg: typing.Optional[discord.Message]):
@@ -73,11 +190,11 @@ class Pins(commands.Cog):
             message = msg or ctx.message.reference.resolved
         except AttributeError:
             raise commands.BadArgument('Could not resolve message reference')
-        else:
-            message = msg
 
         embed = self.generate_embed(message)
         await pins.send(embed=embed)
+        self.checkpoints.mark(message.channel.id, [message.id])
+        await self.index_pins([record_from_message(message, time.time())])
 
 
 def setup(bot):
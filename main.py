@@ -4,11 +4,15 @@
 
 import asyncio
 import aiohttp
+import time
 
 import discord
 from discord.ext import commands
 
 import config
+from utils.http import HTTPClient
+from utils.metrics import Metrics
+from utils.workers import WorkerPool
 
 exts = [
     'jishaku',
@@ -21,18 +25,36 @@ exts = [
 class MyContext(commands.Context):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.started_at = time.perf_counter()
+        self.converted_at = None
+        self.upload_time = 0.0
+
+    async def send(self, *args, **kwargs):
+        if not (kwargs.get('file') or kwargs.get('files')):
+            return await super().send(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await super().send(*args, **kwargs)
+        finally:
+            self.upload_time += time.perf_counter() - start
 
 
 class Bot(commands.Bot):
     _ignored = (commands.CommandNotFound,)
     _print_exc = True
     headers = {'user-agent': f'DiscordBot; Python/3.8.3 aiohttp/{aiohttp.__version__}'}
-    smol_bytes = {'Range': 'bytes=0-10'}
+    host_rates = {'services.runescape.com': (2.0, 4)}  # the GE api starts sending html instead of json if pushed
     def __init__(self, command_prefix, **kwargs):
         super().__init__(command_prefix, **kwargs)
-    
+        self.metrics = Metrics()
+        self.metrics.register('executors', self.executor_stats)
+        self.metrics.register('http', self.http_stats)
+        self.before_invoke(self.mark_converted)
+
     async def connect(self, *, reconnect=True):
         self._session = aiohttp.ClientSession(headers=self.headers)
+        self.web = HTTPClient(self._session, rates=getattr(config, 'HTTP_HOST_RATES', self.host_rates))
+        self.metrics.start(getattr(config, 'METRICS_FILE', 'data/metrics.prom'), getattr(config, 'METRICS_INTERVAL', 60.0))
 
         for ext in exts:
             try:
@@ -45,10 +67,48 @@ class Bot(commands.Bot):
     async def get_context(self, message, cls=MyContext):
         return await super().get_context(message, cls=MyContext)
 
+    async def mark_converted(self, ctx):
+        """Before invoke hook, runs once the arguments are converted and the checks have passed"""
+        ctx.converted_at = time.perf_counter()
+
+    async def invoke(self, ctx):
+        ctx.started_at = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            if ctx.command is not None:
+                self.record_timings(ctx)
+
+    def record_timings(self, ctx):
+        end = time.perf_counter()
+        name = ctx.command.qualified_name
+        converted = getattr(ctx, 'converted_at', None)
+        self.metrics.observe(name, 'convert', (converted or end) - ctx.started_at)
+        if converted is not None:  # a failed conversion or check means the handler never ran
+            upload = getattr(ctx, 'upload_time', 0.0)
+            self.metrics.observe(name, 'handler', max(0.0, end - converted - upload))
+            self.metrics.observe(name, 'upload', upload)
+        self.metrics.observe(name, 'total', end - ctx.started_at)
+
+    def executor_stats(self):
+        """Queue depth and the like for every WorkerPool a cog has"""
+        out = {}
+        for cog_name, cog in self.cogs.items():
+            for attr, value in vars(cog).items():
+                if isinstance(value, WorkerPool):
+                    out.update({f'{cog_name}.{attr}.{key}': number for key, number in value.stats().items()})
+        return out
+
+    def http_stats(self):
+        if not hasattr(self, 'web'):
+            return {}
+        return {f'{host}.{key}': value for host, stats in self.web.stats().items() for key, value in stats.items()}
+
     async def on_ready(self):
         print('Ready!')
 
     async def close(self):
+        self.metrics.stop()
         await self._session.close()
         return await super().close()
     
@@ -0,0 +1,123 @@
+# utils/alerts.py
+
+import heapq
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+ALERT = np.dtype([('id', '<i8'), ('item', '<i8'), ('user', '<i8'), ('channel', '<i8'), ('price', '<i8'), ('above', '?')])
+
+
+class AlertBook:
+    """Price alerts grouped by item, with a heap of when each item is next due a price check.
+
+    The heap holds one (due, item id) entry per item no matter how many alerts are on it, so every
+    item is polled once a cycle, and each item's alerts sit in one structured array so checking
+    a new price against all of them is a single comparison.
+    """
+    def __init__(self, interval: float = 30 * 60, max_per_user: int = 10):
+        self.interval = interval
+        self.max_per_user = max_per_user
+        self.by_item: Dict[int, np.ndarray] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._scheduled: Dict[int, float] = {}  # heap entries that don't match this are stale
+        self._next_id = 1
+
+    def __len__(self):
+        return sum(alerts.size for alerts in self.by_item.values())
+
+    def __iter__(self) -> Iterator[np.void]:
+        for alerts in self.by_item.values():
+            yield from alerts
+
+    def for_user(self, user_id: int) -> np.ndarray:
+        if not self.by_item:
+            return np.empty(0, dtype=ALERT)
+        alerts = np.concatenate(list(self.by_item.values()))
+        return alerts[alerts['user'] == user_id]
+
+    def add(self, item_id: int, user_id: int, channel_id: int, price: int, above: bool, now: Optional[float] = None) -> int:
+        """Adds an alert and returns its id, raises ValueError if the user already has max_per_user"""
+        if self.for_user(user_id).size >= self.max_per_user:
+            raise ValueError(f"You can't have more than {self.max_per_user} alerts")
+        alert = np.array([(self._next_id, item_id, user_id, channel_id, price, above)], dtype=ALERT)
+        self._next_id += 1
+        if item_id in self.by_item:
+            self.by_item[item_id] = np.concatenate([self.by_item[item_id], alert])
+        else:
+            self.by_item[item_id] = alert
+        if item_id not in self._scheduled:
+            self._schedule(item_id, time.monotonic() if now is None else now)  # new items get checked straight away
+        return int(alert['id'][0])
+
+    def remove(self, alert_id: int, user_id: Optional[int] = None) -> bool:
+        """Removes an alert, only if it's user_id's when that's given"""
+        for item_id, alerts in self.by_item.items():
+            keep = (alerts['id'] != alert_id) | ((alerts['user'] != user_id) if user_id is not None else False)
+            if not keep.all():
+                self._replace(item_id, alerts[keep])
+                return True
+        return False
+
+    def _replace(self, item_id: int, alerts: np.ndarray):
+        # an item left with no alerts is unscheduled, its heap entry goes stale and is dropped by next_due
+        if alerts.size:
+            self.by_item[item_id] = alerts
+        else:
+            del self.by_item[item_id]
+            self._scheduled.pop(item_id, None)
+
+    def _schedule(self, item_id: int, due: float):
+        self._scheduled[item_id] = due
+        heapq.heappush(self._heap, (due, item_id))
+
+    def next_due(self) -> Optional[float]:
+        while self._heap and self._scheduled.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def due(self, now: Optional[float] = None) -> List[int]:
+        """Pops every item due a check, each one is rescheduled once check is called for it"""
+        now = time.monotonic() if now is None else now
+        items = []
+        while self.next_due() is not None and self._heap[0][0] <= now:
+            _, item_id = heapq.heappop(self._heap)
+            del self._scheduled[item_id]
+            items.append(item_id)
+        return items
+
+    def check(self, item_id: int, price: Optional[int], now: Optional[float] = None) -> np.ndarray:
+        """Removes and returns the item's alerts that price crosses, and schedules the item's next check.
+        A price of None (the lookup failed) just reschedules it."""
+        alerts = self.by_item.get(item_id)
+        if alerts is None:
+            return np.empty(0, dtype=ALERT)
+        if price is None:
+            hit = np.zeros(alerts.size, dtype=bool)
+        else:
+            hit = np.where(alerts['above'], price >= alerts['price'], price <= alerts['price'])
+        self._replace(item_id, alerts[~hit])
+        if item_id in self.by_item:
+            self._schedule(item_id, (time.monotonic() if now is None else now) + self.interval)
+        return alerts[hit]
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> 'AlertBook':
+        book = cls(**kwargs)
+        if os.path.exists(path):
+            alerts = np.load(path)
+            now = time.monotonic()
+            for item_id in np.unique(alerts['item']):
+                book.by_item[int(item_id)] = alerts[alerts['item'] == item_id]
+                book._schedule(int(item_id), now)
+            book._next_id = int(alerts['id'].max()) + 1 if alerts.size else 1
+        return book
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        alerts = np.concatenate(list(self.by_item.values())) if self.by_item else np.empty(0, dtype=ALERT)
+        tmp = path + ".tmp.npy"
+        np.save(tmp, alerts)
+        os.replace(tmp, path)
@@ -0,0 +1,290 @@
+# utils/cache.py
+
+import asyncio
+from collections import Counter, OrderedDict
+import hashlib
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import discord
+
+
+class ResultCache:
+    """An LRU cache of bytes keyed on content digests, bounded by total size rather than entry count.
+
+    If a directory is given, entries are also written to disk with their own byte budget,
+    so results survive restarts and entries pushed out of memory can still be served.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, directory: Optional[str] = None, max_disk_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.directory = directory
+        self._memory: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._disk: 'OrderedDict[str, int]' = OrderedDict()
+        self.size = 0
+        self.disk_size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan_disk()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __contains__(self, key: str):
+        return key in self._memory or key in self._disk
+
+    @staticmethod
+    def make_key(op: str, *args) -> str:
+        """Digest of an operation name and its arguments, bytes arguments are hashed by content"""
+        digest = hashlib.blake2b(op.encode(), digest_size=16)
+        for arg in args:
+            raw = arg if isinstance(arg, (bytes, bytearray)) else repr(arg).encode()
+            digest.update(len(raw).to_bytes(8, 'little'))
+            digest.update(raw)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Memory tier only, doesn't touch the disk"""
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        if key in self._memory:
+            self.size -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self.size -= len(evicted)
+
+    async def fetch(self, key: str) -> Optional[bytes]:
+        """Checks memory, then disk, promoting disk hits back into memory"""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if key in self._disk:
+            value = await asyncio.get_event_loop().run_in_executor(None, self._read_file, key)
+            if value is None:
+                self.disk_size -= self._disk.pop(key, 0)
+            else:
+                self._disk.move_to_end(key)
+                self.disk_hits += 1
+                self.put(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    async def store(self, key: str, value: bytes):
+        self.put(key, value)
+        if not self.directory or key in self._disk or len(value) > self.max_disk_bytes:
+            return
+        loop = asyncio.get_event_loop()
+        if await loop.run_in_executor(None, self._write_file, key, value):
+            self._disk[key] = len(value)
+            self.disk_size += len(value)
+            evicted = self._evict_disk()
+            if evicted:
+                await loop.run_in_executor(None, self._remove_files, evicted)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _scan_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self.disk_size += size
+        self._remove_files(self._evict_disk())
+
+    def _evict_disk(self) -> List[str]:
+        evicted = []
+        while self.disk_size > self.max_disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self.disk_size -= size
+            evicted.append(key)
+        return evicted
+
+    # the methods below only do file io, they run in the default executor
+
+    def _read_file(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                value = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            return None
+        return value
+
+    def _write_file(self, key: str, value: bytes) -> bool:
+        tmp = self._path(key) + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(value)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            return False
+        return True
+
+    def _remove_files(self, keys: List[str]):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._memory),
+            'bytes': self.size,
+            'disk_entries': len(self._disk),
+            'disk_bytes': self.disk_size,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
+
+
+class AvatarCache:
+    """Avatars as ready to use PNG bytes, keyed on user id and avatar hash so a new avatar is a new key.
+
+    Old avatars aren't removed explicitly, they just stop being used and fall off the end of the LRU.
+    Users who use image commands at least prefetch_after times get their new avatar fetched as soon
+    as they change it, see prefetch.
+    """
+    size = 128
+    max_tracked = 1000
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, prefetch_after: int = 5):
+        self._cache = ResultCache(max_bytes=max_bytes)
+        self.prefetch_after = prefetch_after
+        self.uses: Counter = Counter()
+        self.prefetched = 0
+
+    @staticmethod
+    def make_key(user: discord.abc.User) -> str:
+        return f"{user.id}:{user.avatar or user.default_avatar.value}"
+
+    async def _download(self, user: discord.abc.User) -> bytes:
+        return await user.avatar_url_as(format="png", size=self.size).read()
+
+    async def get(self, user: discord.abc.User) -> bytes:
+        self._track(user.id)
+        key = self.make_key(user)
+        data = self._cache.get(key)
+        if data is not None:
+            self._cache.hits += 1
+            return data
+        self._cache.misses += 1
+        data = await self._download(user)
+        self._cache.put(key, data)
+        return data
+
+    def _track(self, user_id: int):
+        self.uses[user_id] += 1
+        if len(self.uses) > self.max_tracked:  # keep the heaviest users, halve everyone so old usage fades
+            self.uses = Counter({uid: count // 2 for uid, count in self.uses.most_common(self.max_tracked // 2)})
+
+    def is_frequent(self, user_id: int) -> bool:
+        return self.uses[user_id] >= self.prefetch_after
+
+    async def prefetch(self, user: discord.abc.User):
+        """Fetches a frequent user's current avatar ahead of time, does nothing for anyone else"""
+        key = self.make_key(user)
+        if not self.is_frequent(user.id) or key in self._cache:
+            return
+        try:
+            self._cache.put(key, await self._download(user))
+        except discord.HTTPException:
+            return
+        self.prefetched += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._cache.stats(), 'tracked': len(self.uses), 'prefetched': self.prefetched}
+
+
+class TTLCache:
+    """An async LRU cache for lookups whose answers go stale, each entry expires ttl seconds after it's fetched.
+
+    Concurrent misses for the same key share a single fetch, so a burst of people asking for the
+    same thing only goes upstream once. Failed fetches aren't cached, every waiter gets the error.
+    """
+    def __init__(self, ttl: float, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Any]], ttl: Optional[float] = None) -> Any:
+        """The cached value for key, or the result of awaiting fetch() if there isn't a fresh one"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fill(key, fetch, self.ttl if ttl is None else ttl))
+            self._inflight[key] = task
+            task.add_done_callback(self._settle)
+        # shielded so one caller giving up doesn't cancel the fetch for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def _fill(self, key: Hashable, fetch: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        try:
+            value = await fetch()
+        finally:
+            self._inflight.pop(key, None)
+        self.put(key, value, ttl)
+        return value
+
+    @staticmethod
+    def _settle(task: asyncio.Task):
+        if not task.cancelled():
+            task.exception()  # retrieved here so it isn't logged as unhandled if every waiter gave up
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._entries),
+            'in_flight': len(self._inflight),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+        }
@@ -0,0 +1,84 @@
+# utils/charts.py
+
+"""Price charts drawn on their own Figure and Agg canvas, nothing touches pyplot's global state.
+
+These run in the chart worker processes, so arguments and results are plain numpy arrays and bytes.
+"""
+
+from io import BytesIO
+from typing import Optional, Sequence, Tuple
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import style
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+
+TITLE = "{item}: avg={avg:,}gp, \nmax={max_price:,}gp, min={min_price:,}gp"
+STYLE = 'default'
+
+Series = Tuple[str, np.ndarray, np.ndarray]  # name, ms timestamps, prices
+
+
+def warm():
+    """Worker initializer, loads the style and the font cache and does a throwaway draw
+    so the first real chart in each worker doesn't pay for it"""
+    style.use(STYLE)
+    render_prices([('warmup', np.array([0, 86400000], dtype=np.int64), np.array([1, 2], dtype=np.int64))], max_width=1, separate=True)
+
+
+def _new_figure(rows: int, cols: int) -> Tuple[Figure, FigureCanvasAgg]:
+    figure = Figure(figsize=(6.4 * max(1, cols * 0.75), 4.8 * max(1, rows * 0.75)))
+    return figure, FigureCanvasAgg(figure)
+
+
+def _to_png(figure: Figure, canvas: FigureCanvasAgg) -> bytes:
+    figure.tight_layout()
+    out = BytesIO()
+    canvas.print_png(out)
+    return out.getvalue()
+
+
+def _dates(timestamps: np.ndarray) -> np.ndarray:
+    return np.asarray(timestamps, dtype=np.int64).astype('datetime64[ms]')
+
+
+def title_for(name: str, prices: np.ndarray) -> str:
+    prices = np.asarray(prices, dtype=np.int64)
+    if not prices.size:
+        return f"{name}: no price data"
+    return TITLE.format(item=name, avg=int(prices.mean()), max_price=int(prices.max()), min_price=int(prices.min()))
+
+
+def grid_shape(count: int, max_width: int) -> Tuple[int, int]:
+    cols = min(count, max_width)
+    rows = -(-count // cols)
+    return rows, cols
+
+
+def render_prices(series: Sequence[Series], max_width: int = 3, separate: bool = True, title: Optional[str] = None) -> bytes:
+    """PNG bytes of one chart per item in a grid, or every item on one chart if not separate"""
+    if separate:
+        rows, cols = grid_shape(len(series), max_width)
+        figure, canvas = _new_figure(rows, cols)
+        for number, (name, timestamps, prices) in enumerate(series, 1):
+            axes = figure.add_subplot(rows, cols, number)
+            axes.plot(_dates(timestamps), prices)
+            axes.set_title(title_for(name, prices) if len(series) == 1 else name, fontsize='small')
+            axes.tick_params(axis='x', labelrotation=30, labelsize='x-small')
+        if len(series) == 1:
+            axes.set_xlabel('Date')
+            axes.set_ylabel('Prices')
+    else:
+        figure, canvas = _new_figure(1, 1)
+        axes = figure.add_subplot(1, 1, 1)
+        for name, timestamps, prices in series:
+            axes.plot(_dates(timestamps), prices, label=name)
+        axes.set_xlabel('Date')
+        axes.set_ylabel('Prices')
+        axes.set_title(title or ', '.join(name for name, _, _ in series))
+        axes.legend(fontsize='small')
+        axes.tick_params(axis='x', labelrotation=30)
+    return _to_png(figure, canvas)
+
@@ -1,8 +1,33 @@
 # containers.py
 
+from collections import OrderedDict
+import json
+import time
+from typing import Dict, Hashable, List, Optional
+
 import numpy as np
 
+_suffixes = {'k': 1_000, 'm': 1_000_000, 'b': 1_000_000_000}
+
+def parse_price(price) -> int:
+    """The GE API gives prices as ints or strings like "1,234", "12.5k" or "- 1.2m" """
+    if isinstance(price, (int, float)):
+        return int(price)
+    price = price.replace(',', '').replace(' ', '').lower()
+    if price and price[-1] in _suffixes:
+        return int(float(price[:-1]) * _suffixes[price[-1]])
+    return int(float(price))
+
 class OSRSObject:
+    """An item from the GE detail endpoint, keeping only what the bot uses.
+
+    Slotted, with trends stored as small codes and the 30/90/180 day changes as floats,
+    so cached items don't carry the whole payload around with them.
+    """
+    __slots__ = ('id', 'name', 'description', 'members', 'price', 'price_text', 'trend', 'today', 'changes', 'change_trends')
+
+    trends = ('neutral', 'positive', 'negative')
+    periods = ('day30', 'day90', 'day180')
     times = {
         '1 month': 'day30',
         '1m' : 'day30',
@@ -18,26 +43,138 @@ class OSRSObject:
         '180d': 'day180'
     }
     def __init__(self, data):
-        data = data['item']
-        for k, v in data.items():
-            setattr(self, k, v)
+        data = data.get('item', data)
+        self.id = int(data['id'])
+        self.name = data['name']
+        self.description = data.get('description', '')
+        self.members = str(data.get('members', 'false')).lower() == 'true'
+        current = data['current']
+        self.price_text = str(current['price'])
+        self.price = parse_price(current['price'])
+        self.trend = self._trend_code(current.get('trend'))
+        self.today = self._trend_code(data.get('today', {}).get('trend'))
+        self.changes = tuple(self._percent(data.get(period, {}).get('change')) for period in self.periods)
+        self.change_trends = bytes(self._trend_code(data.get(period, {}).get('trend')) for period in self.periods)
+
+    def __repr__(self): return f"<class OSRSObject; name=\"{self.name}\", current price={self.price_text} gp>"
+
+    @classmethod
+    def _trend_code(cls, trend: Optional[str]) -> int:
+        return cls.trends.index(trend) if trend in cls.trends else 0
+
+    @staticmethod
+    def _percent(change: Optional[str]) -> float:
+        try:
+            return float(str(change).rstrip('%').replace('+', ''))
+        except ValueError:
+            return float('nan')
 
-    def __repr__(self): return f"<class OSRSObject; name=\"{self.name}\", current price={self.current['price']} gp>"
+    @classmethod
+    def from_jsonl(cls, path: str) -> List['OSRSObject']:
+        """Every item in a JSON lines file of detail payloads, skipping lines that aren't one"""
+        items = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    items.append(cls(json.loads(line)))
+                except (KeyError, ValueError, TypeError, AttributeError):
+                    continue
+        return items
+
+    @property
+    def current(self) -> Dict[str, str]:
+        return {'price': self.price_text, 'trend': self.trends[self.trend]}
+
+    @property
+    def is_members(self) -> bool:
+        return self.members
+
+    def period(self, period: str) -> Dict[str, str]:
+        index = self.periods.index(period)
+        return {'trend': self.trends[self.change_trends[index]], 'change': f"{self.changes[index]:+.1f}%"}
 
     def show(self, time: str):
         if time in self.times.keys():
-            print(getattr(self, self.times[time]))
+            print(self.period(self.times[time]))
 
     @property
     def print(self):
         out = f"Name: {self.name}\n"
         out += f"ID: {self.id}\n"
         out += f"Description: {self.description}\n"
-        out += f"Current price: {self.current['price']}\n"
-        out += f"Current trend: {self.current['trend']}\n"
+        out += f"Current price: {self.price_text}\n"
+        out += f"Current trend: {self.trends[self.trend]}\n"
         return out
 
 
+class Watchlists:
+    """Item ids and names people are queueing up to graph, one list per key (a user, or a user in a channel).
+
+    Lists are kept in least recently used order, so lists idle for longer than `idle` seconds are
+    dropped from the front on each access, and the oldest go first when there are over max_lists.
+    """
+    def __init__(self, max_lists: int = 1000, max_items: int = 9, idle: float = 6 * 60 * 60):
+        self.max_lists = max_lists
+        self.max_items = max_items
+        self.idle = idle
+        self._lists: 'OrderedDict[Hashable, Dict[int, str]]' = OrderedDict()
+        self._used: Dict[Hashable, float] = {}
+
+    def __len__(self):
+        return len(self._lists)
+
+    def _expire(self, now: float):
+        while self._lists:
+            key = next(iter(self._lists))
+            if now - self._used[key] < self.idle and len(self._lists) <= self.max_lists:
+                break
+            del self._lists[key], self._used[key]
+
+    def _touch(self, key: Hashable) -> Optional[Dict[int, str]]:
+        now = time.monotonic()
+        self._expire(now)
+        entries = self._lists.get(key)
+        if entries is not None:
+            self._lists.move_to_end(key)
+            self._used[key] = now
+        return entries
+
+    def get(self, key: Hashable) -> Dict[int, str]:
+        return dict(self._touch(key) or {})
+
+    def add(self, key: Hashable, item_id: int, name: str) -> bool:
+        """False if the item's already there, raises ValueError if the list is full"""
+        entries = self._touch(key)
+        if entries is None:
+            entries = self._lists[key] = {}
+            self._used[key] = time.monotonic()
+            self._expire(self._used[key])
+        if item_id in entries:
+            return False
+        if len(entries) >= self.max_items:
+            raise ValueError(f"Watchlists can't have more than {self.max_items} items")
+        entries[item_id] = name
+        return True
+
+    def remove(self, key: Hashable, item_id: int) -> bool:
+        entries = self._touch(key)
+        if not entries or item_id not in entries:
+            return False
+        del entries[item_id]
+        return True
+
+    def pop(self, key: Hashable) -> Dict[int, str]:
+        self._touch(key)
+        self._used.pop(key, None)
+        return self._lists.pop(key, {})
+
+    def stats(self) -> Dict[str, int]:
+        self._expire(time.monotonic())
+        return {'lists': len(self._lists), 'items': sum(map(len, self._lists.values()))}
+
+
 class DieEval:
     value = 0
     average = 0
@@ -1,13 +1,17 @@
 # converters.py
 
 import aiohttp
+import asyncio
 from io import BytesIO
 import re
+from typing import Iterable, List, Optional, Tuple
 
 import discord
 from discord.ext import commands
 
+import config
 from utils.containers import DieEval
+from utils.image_funcs import SHIFT_MODES, Stage, _sniff_format, parse_pipeline
 
 class GuildConverter(commands.IDConverter):
     async def convert(self, ctx: commands.Context, arg: str) -> discord.Guild:
@@ -28,21 +32,66 @@ class GuildConverter(commands.IDConverter):
         return result
 
 class LinkConverter(commands.Converter):
-    png_header = b"\x89\r\n\x1a\n"
-    jpg_header = b"\xff\xd8\xff"
-    short_read = {'Range': 'bytes=0-10'}
+    max_bytes = getattr(config, 'MAX_DOWNLOAD_BYTES', 8 * 1024 * 1024)
 
-    async def convert(self, ctx: commands.Context, arg: str) -> BytesIO:
-        bot = ctx.bot
-        arg = arg.strip('<>')
-        async with bot._session.get(arg, headers=short_read) as res:
-            raw_bytes = await res.read()
-        if raw_bytes.startswith((self.png_header, self.jpg_header)):
-            async with bot._session.get(arg) as real_res:
-                img_bytes = BytesIO(await real_res.read())
-                return img_bytes
-        else:
+    @staticmethod
+    def sniff(head: bytes) -> Optional[str]:
+        return _sniff_format(head)
+
+    @classmethod
+    async def fetch(cls, session: aiohttp.ClientSession, url: str, max_bytes: Optional[int] = None) -> BytesIO:
+        """Streams an image from url in a single request, giving up as soon as it's too big or not an image"""
+        max_bytes = max_bytes or cls.max_bytes
+        try:
+            async with session.get(url) as res:
+                if res.status != 200:
+                    raise commands.BadArgument(f"URL returned status {res.status}.")
+                length = res.content_length
+                if length is not None and length > max_bytes:
+                    raise commands.BadArgument(f"File is bigger than the {max_bytes // 1024} KB limit.")
+
+                buffer = bytearray(length or 0)
+                size = 0
+                fmt = None
+                async for chunk in res.content.iter_any():
+                    end = size + len(chunk)
+                    if end > max_bytes:
+                        raise commands.BadArgument(f"File is bigger than the {max_bytes // 1024} KB limit.")
+                    buffer[size:end] = chunk
+                    size = end
+                    if fmt is None and size >= 12:
+                        fmt = cls.sniff(bytes(buffer[:12]))
+                        if fmt is None:
+                            raise commands.BadArgument('URL doesn\'t lead to a valid file.')
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            raise commands.BadArgument('URL couldn\'t be downloaded.')
+
+        del buffer[size:]
+        if fmt is None and cls.sniff(bytes(buffer)) is None:
             raise commands.BadArgument('URL doesn\'t lead to a valid file.')
+        return BytesIO(buffer)
+
+    @classmethod
+    async def fetch_many(cls, ctx: commands.Context, urls: Iterable[str]) -> List[BytesIO]:
+        """Downloads several links at once, raising the first failure"""
+        return list(await asyncio.gather(*[cls.fetch(ctx.bot._session, url.strip('<>')) for url in urls]))
+
+    async def convert(self, ctx: commands.Context, arg: str) -> BytesIO:
+        return await self.fetch(ctx.bot._session, arg.strip('<>'))
+
+class ShiftModeConverter(commands.Converter):
+    async def convert(self, ctx: commands.Context, arg: str) -> str:
+        arg = arg.lower()
+        if arg in SHIFT_MODES:
+            return arg
+        raise commands.BadArgument(f"{arg} is not a shift mode, pick from {', '.join(SHIFT_MODES)}")
+
+class PipelineConverter(commands.Converter):
+    async def convert(self, ctx: commands.Context, arg: str) -> Tuple[Stage, ...]:
+        try:
+            return parse_pipeline(arg)
+        except ValueError as exc:
+            raise commands.BadArgument(str(exc))
 
 class CommandConverter(commands.Converter):
     async def convert(self, ctx: commands.Context, arg: str) -> commands.Command:
@@ -0,0 +1,101 @@
+# utils/errors.py
+
+from collections import OrderedDict, deque
+import hashlib
+import os
+import time
+import traceback
+from types import TracebackType
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+def fingerprint(exc: BaseException) -> str:
+    """Digest of an exception's type and the code locations in its traceback, so the same failure
+    from the same place always matches no matter the message. Walks the frames directly rather than
+    formatting the traceback, which would read the source files."""
+    digest = hashlib.blake2b(type(exc).__qualname__.encode(), digest_size=8)
+    tb: Optional[TracebackType] = exc.__traceback__
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        digest.update(f"{os.path.basename(code.co_filename)}:{code.co_name}:{tb.tb_lineno};".encode())
+        tb = tb.tb_next
+    return digest.hexdigest()
+
+
+class ErrorEntry:
+    __slots__ = ('fingerprint', 'name', 'count', 'first_seen', 'last_seen', 'last_reported', 'suppressed', 'first_traceback', 'samples')
+
+    def __init__(self, key: str, name: str, samples: int, now: float):
+        self.fingerprint = key
+        self.name = name
+        self.count = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.last_reported = 0.0
+        self.suppressed = 0
+        self.first_traceback = ''
+        self.samples: Deque[Tuple[float, str, str]] = deque(maxlen=samples)  # (when, where, message)
+
+
+class ErrorTracker:
+    """Counts errors by fingerprint, keeping the last few samples of each in a ring buffer.
+
+    Only the first occurrence of a fingerprint has its traceback formatted and kept, later ones are
+    stored as a message, so nothing holds on to exceptions or their frames. The least recently seen
+    fingerprints are dropped past max_fingerprints. should_report allows one user facing report per
+    fingerprint every report_every seconds.
+    """
+    def __init__(self, samples: int = 5, max_fingerprints: int = 200, report_every: float = 60.0):
+        self.max_samples = samples
+        self.max_fingerprints = max_fingerprints
+        self.report_every = report_every
+        self.entries: 'OrderedDict[str, ErrorEntry]' = OrderedDict()
+        self.total = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, exc: BaseException, where: str = '', now: Optional[float] = None) -> Tuple[ErrorEntry, bool]:
+        """Adds an error, returns its entry and whether this was the first time it was seen"""
+        now = time.time() if now is None else now
+        key = fingerprint(exc)
+        entry = self.entries.get(key)
+        new = entry is None
+        if new:
+            entry = self.entries[key] = ErrorEntry(key, type(exc).__qualname__, self.max_samples, now)
+            entry.first_traceback = ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+            while len(self.entries) > self.max_fingerprints:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        entry.count += 1
+        entry.last_seen = now
+        entry.samples.append((now, where, str(exc)[:500]))
+        self.total += 1
+        return entry, new
+
+    def should_report(self, entry: ErrorEntry, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        if now - entry.last_reported < self.report_every:
+            entry.suppressed += 1
+            return False
+        entry.last_reported = now
+        return True
+
+    def find(self, prefix: str) -> Optional[ErrorEntry]:
+        matches = [entry for key, entry in self.entries.items() if key.startswith(prefix)]
+        return matches[0] if len(matches) == 1 else None
+
+    def top(self, limit: int = 5) -> List[ErrorEntry]:
+        return sorted(self.entries.values(), key=lambda entry: (entry.count, entry.last_seen), reverse=True)[:limit]
+
+    def clear(self):
+        self.entries.clear()
+        self.total = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'fingerprints': len(self.entries),
+            'total': self.total,
+            'suppressed': sum(entry.suppressed for entry in self.entries.values()),
+        }
@@ -0,0 +1,179 @@
+# utils/http.py
+
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+from discord.ext import commands
+
+
+class HTTPError(commands.CommandError):
+    def __init__(self, url: str, status: Optional[int] = None, reason: str = ''):
+        self.url = url
+        self.status = status
+        host = urlsplit(url).netloc
+        super().__init__(f"{host} {'returned ' + str(status) if status else 'failed'}{': ' + reason if reason else ''}")
+
+
+class TokenBucket:
+    """Allows `rate` requests a second on average, with bursts of up to `capacity`"""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self) -> float:
+        """Waits for a token, returns how long that took"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        start = time.monotonic()
+        async with self._lock:  # waiters queue up in order instead of all waking at once
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - start
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostStats:
+    __slots__ = ('requests', 'errors', 'retries', 'throttled', 'latency', 'max_latency')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled = 0.0  # seconds spent waiting on the token bucket
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'throttled': round(self.throttled, 3),
+            'avg_latency': round(self.latency / self.requests, 3) if self.requests else 0.0,
+            'max_latency': round(self.max_latency, 3),
+        }
+
+
+class HTTPClient:
+    """Wraps the bot's shared aiohttp session with per-host limits, rate limiting and retries.
+
+    Every host gets its own concurrency limit and token bucket, hosts in `rates` get their own
+    (rate, burst) instead of the defaults. Connection errors, timeouts, 429s, 5xxs and, for json(),
+    bodies that don't parse are retried with jittered exponential backoff, capped at max_backoff;
+    anything else, or a Retry-After longer than the cap, is raised straight away as an HTTPError.
+    Nothing here is tied to a host, so pointing the cogs' URLs at a local stub server works the same.
+    """
+    retry_statuses = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        per_host: int = 4,
+        rate: float = 5.0,
+        burst: int = 10,
+        rates: Optional[Dict[str, Tuple[float, int]]] = None,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        timeout: float = 10.0,
+    ):
+        self.session = session
+        self.per_host = per_host
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._limits: Dict[str, asyncio.Semaphore] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.hosts: Dict[str, HostStats] = {}
+
+    def _host(self, url: str) -> str:
+        host = urlsplit(url).netloc
+        if host not in self._limits:
+            self._limits[host] = asyncio.Semaphore(self.per_host)
+            self._buckets[host] = TokenBucket(*self.rates.get(host, (self.rate, self.burst)))
+            self.hosts[host] = HostStats()
+        return host
+
+    def _delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return min(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5), self.max_backoff)
+
+    async def _attempt(self, host: str, method: str, url: str, **kwargs) -> Tuple[int, bytes, Optional[str]]:
+        stats = self.hosts[host]
+        async with self._limits[host]:
+            stats.throttled += await self._buckets[host].acquire()
+            start = time.perf_counter()
+            try:
+                async with self.session.request(method, url, timeout=self.timeout, **kwargs) as resp:
+                    body = await resp.read()
+                    return resp.status, body, resp.headers.get('Retry-After')
+            finally:
+                elapsed = time.perf_counter() - start
+                stats.requests += 1
+                stats.latency += elapsed
+                stats.max_latency = max(stats.max_latency, elapsed)
+
+    async def request(self, method: str, url: str, parse_json: bool = False, **kwargs) -> Any:
+        """The response body as bytes, or parsed if parse_json, retrying what looks temporary"""
+        host = self._host(url)
+        stats = self.hosts[host]
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            retry_after = None
+            try:
+                status, body, retry_after = await self._attempt(host, method, url, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                stats.errors += 1
+                if last:
+                    raise HTTPError(url, reason=type(exc).__name__) from exc
+            else:
+                if status in self.retry_statuses:
+                    stats.errors += 1
+                    if last:
+                        raise HTTPError(url, status)
+                    if retry_after and retry_after.isdigit() and float(retry_after) > self.max_backoff:
+                        # not worth holding a command (and a slot for the host) that long, give up now
+                        raise HTTPError(url, status, f'asked to retry after {retry_after}s')
+                elif status >= 400:
+                    stats.errors += 1
+                    raise HTTPError(url, status)
+                elif not parse_json:
+                    return body
+                else:
+                    try:
+                        return json.loads(body)
+                    except ValueError:  # the GE sends an html page instead of json when it's struggling
+                        stats.errors += 1
+                        if last:
+                            raise
+            stats.retries += 1
+            await asyncio.sleep(self._delay(attempt, retry_after))
+
+    async def read(self, url: str, **kwargs) -> bytes:
+        return await self.request('GET', url, **kwargs)
+
+    async def text(self, url: str, encoding: str = 'utf-8', **kwargs) -> str:
+        return (await self.request('GET', url, **kwargs)).decode(encoding, errors='replace')
+
+    async def json(self, url: str, **kwargs) -> Any:
+        return await self.request('GET', url, parse_json=True, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {host: stats.as_dict() for host, stats in self.hosts.items()}
@@ -1,12 +1,16 @@
 # utils/image_funcs.py
 
-from functools import lru_cache
 from io import BytesIO
-from typing import Optional, Tuple
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Union
 
 import numpy as np
-from numpy.random import randint
-from PIL import Image, ImageChops, ImageFilter
+from PIL import GifImagePlugin, Image, ImageChops, ImageFilter, ImageSequence, features
+
+try:  # the workers and benchmarks don't need the bot's config, it only overrides working sizes
+    import config
+except ImportError:
+    config = None
 
 FILTERS = {
     "blur": ImageFilter.BLUR,
@@ -21,114 +25,473 @@ FILTERS = {
     "moresmooth": ImageFilter.SMOOTH_MORE,
 }
 
+# largest size each command works at, images are shrunk to fit inside this while decoding
+WORKING_SIZES = {
+    "shift": (1024, 1024),
+    "jpeg": (1024, 1024),
+    "jpeg_gif": (512, 512),
+    "diff": (1024, 1024),
+    "invert": (1280, 1280),
+    "poster": (1280, 1280),
+    "filter": (1280, 1280),
+    "rotate": (1280, 1280),
+    "pipe": (1280, 1280),
+    **getattr(config, 'IMAGE_WORKING_SIZES', {}),
+}
 
-@lru_cache(maxsize=10)
-def _shifter(attachment_file: BytesIO, size: Tuple[int, int]) -> BytesIO:
-
-    image_obj = Image.open(attachment_file)
-
-    bands = image_obj.split()
-
-    red_data    = list(bands[0].getdata())
-    green_data  = list(bands[1].getdata())
-    blue_data   = list(bands[2].getdata())
+def _open(data: bytes, max_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """Decodes an image, shrinking it as early and cheaply as possible if it's bigger than max_size
+
+    JPEGs are drafted so libjpeg decodes straight at a reduced scale, anything still more than
+    twice too big is reduce()d by a whole factor, and thumbnail() does the last bit with aspect kept."""
+    image_obj = Image.open(BytesIO(data))
+    if max_size is None:
+        return image_obj
+
+    max_width, max_height = max_size
+    if image_obj.format == "JPEG":
+        image_obj.draft("RGB", max_size)
+
+    ratio = max(image_obj.width / max_width, image_obj.height / max_height)
+    if ratio > 1 and image_obj.mode in ("P", "1"):  # reduce() can't do these, and resampling a palette is nearest only
+        image_obj = image_obj.convert("RGBA" if _has_alpha(image_obj) else "RGB")
+    if ratio >= 2:
+        image_obj = image_obj.reduce(int(ratio))
+    if ratio > 1:
+        image_obj.thumbnail(max_size, Image.BILINEAR)
+    return image_obj
+
+def _save(image_obj: Image.Image, format: str = "PNG", **params) -> bytes:
+    out_file = BytesIO()
+    image_obj.save(out_file, format=format, **params)
+    return out_file.getvalue()
+
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+DEFAULT_TARGET_BYTES = 8 * 1024 * 1024
+GENERATION_FRAMES = 120
+GENERATION_FRAME_MS = 80
+GENERATION_TIME_BUDGET = 15.0
+HAS_WEBP = features.check("webp")
+
+def _sniff_format(head: bytes) -> Optional[str]:
+    """Works out the image format from the first few bytes of a file, None if it isn't one we handle"""
+    for signature, fmt in SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def _has_alpha(image_obj: Image.Image) -> bool:
+    return "A" in image_obj.getbands() or "transparency" in image_obj.info
+
+def _fit_quality(encode: Callable[[int], bytes], target_bytes: int, low: int = 20, high: int = 90, steps: int = 5) -> Tuple[Optional[bytes], int]:
+    """Binary searches for the highest quality whose output fits target_bytes, trying at most steps encodes
+
+    Returns the output and how many encodes it took, the output is None if nothing tried fit"""
+    data = encode(high)
+    attempts = 1
+    if len(data) <= target_bytes:
+        return data, attempts
+
+    best = None
+    high -= 1
+    while low <= high and attempts < steps:
+        quality = (low + high) // 2
+        data = encode(quality)
+        attempts += 1
+        if len(data) <= target_bytes:
+            best = data
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best, attempts
+
+def _encode(image_obj: Image.Image, target_bytes: Optional[int] = None) -> Tuple[bytes, Dict[str, Any]]:
+    """Picks a format and settings for the output based on what the image looks like and how big it's allowed to be
+
+    Flat images (256 colours or fewer) go to PNG, falling back to lossless then lossy WebP if that's too big.
+    Photos go to JPEG, or lossy WebP if they have transparency, with a bounded search on quality to fit."""
+    start = time.perf_counter()
+    target_bytes = target_bytes or DEFAULT_TARGET_BYTES
+    alpha = _has_alpha(image_obj)
+    if image_obj.mode not in ("RGB", "RGBA", "L"):
+        image_obj = image_obj.convert("RGBA" if alpha else "RGB")
+
+    data, fmt, attempts = None, None, 0
+    if image_obj.getcolors(maxcolors=256) is not None:
+        # with 256 colours or fewer an adaptive palette is lossless and a third of the data to compress
+        paletted = image_obj.convert("P", palette=Image.ADAPTIVE, colors=256) if image_obj.mode == "RGB" else image_obj
+        data, fmt = _save(paletted, "PNG", compress_level=6), "png"
+        attempts += 1
+        if len(data) > target_bytes and HAS_WEBP:
+            data, fmt = _save(image_obj, "WEBP", lossless=True, method=0), "webp"
+            attempts += 1
+        if len(data) > target_bytes:
+            data = None
+
+    for scale in (1.0, 0.75, 0.5, 0.25):
+        if data is not None:
+            break
+        scaled = image_obj if scale == 1.0 else image_obj.resize((max(1, int(image_obj.width * scale)), max(1, int(image_obj.height * scale))), Image.BILINEAR)
+        if alpha and HAS_WEBP:
+            fmt = "webp"
+            data, tries = _fit_quality(lambda q: _save(scaled, "WEBP", quality=q, method=2), target_bytes)
+        else:
+            fmt = "jpeg"
+            rgb = scaled if scaled.mode in ("RGB", "L") else scaled.convert("RGB")
+            data, tries = _fit_quality(lambda q: _save(rgb, "JPEG", quality=q, optimize=False), target_bytes)
+        attempts += tries
+
+    if data is None:  # nothing fit, send the smallest thing tried rather than nothing
+        fallback = image_obj.copy()
+        fallback.thumbnail((256, 256), Image.BILINEAR)
+        data, fmt = _save(fallback.convert("RGB"), "JPEG", quality=50), "jpeg"
+
+    info = {
+        "format": fmt,
+        "size": len(data),
+        "encode_time": time.perf_counter() - start,
+        "attempts": attempts,
+    }
+    return data, info
+
+SHIFT_MODES = ("bands", "rows", "columns", "wrap")
+
+def _swap_segments(band: np.ndarray, rng: np.random.Generator):
+    """Swaps a random run of a flattened band with the run straight after it, in place"""
+    total   = band.shape[0]
+    r_num   = int(rng.integers(0, total))
+    low     = int(rng.integers(1, 15))
+    high    = int(rng.integers(low, 30))
+    start   = r_num // high
+    end     = r_num // low
+    width   = min(end - start, total - end)
+    segment = band[start:start + width].copy()
+    band[start:start + width] = band[end:end + width]
+    band[end:end + width] = segment
+
+def _shift_array(pixels: np.ndarray, mode: str = "bands", rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """Shifts the colour channels of a (height, width, channels) array in place, any alpha channel is left alone
+
+    bands   - swaps runs of pixels in each flattened channel, the original shift
+    rows    - slides a random strip of rows sideways per channel
+    columns - slides a random strip of columns up or down per channel
+    wrap    - rolls each whole channel by its own offset, wrapping round the edges
+    """
+    if mode not in SHIFT_MODES:
+        raise ValueError(f"Unknown shift mode {mode!r}")
+    rng = rng or np.random.default_rng()
+    height, width, channels = pixels.shape
+    colours = min(channels, 3)
+
+    if mode == "bands":
+        flat = pixels.reshape(-1, channels)
+        for c in range(colours):
+            _swap_segments(flat[:, c], rng)
+
+    elif mode == "rows":
+        for c in range(colours):
+            top     = int(rng.integers(0, height))
+            bottom  = int(rng.integers(top, height)) + 1
+            offset  = int(rng.integers(-width // 4, width // 4 + 1))
+            pixels[top:bottom, :, c] = np.roll(pixels[top:bottom, :, c], offset, axis=1)
+
+    elif mode == "columns":
+        for c in range(colours):
+            left    = int(rng.integers(0, width))
+            right   = int(rng.integers(left, width)) + 1
+            offset  = int(rng.integers(-height // 4, height // 4 + 1))
+            pixels[:, left:right, c] = np.roll(pixels[:, left:right, c], offset, axis=0)
 
-    for col in [red_data, green_data, blue_data]:
-        r_num   = randint(0, len(col))
-        low     = randint(1, 15)
-        high    = randint(low, 30)
-        i[random_num // high : random_num // low] = i[random_num // low : random_num // high]
+    else:
+        for c in range(colours):
+            dy = int(rng.integers(-height // 8, height // 8 + 1))
+            dx = int(rng.integers(-width // 8, width // 8 + 1))
+            pixels[:, :, c] = np.roll(pixels[:, :, c], (dy, dx), axis=(0, 1))
 
-    new_red = Image.new("L", size)
-    new_red.putdata(red_data)
+    return pixels
 
-    new_green = Image.new("L", size)
-    new_green.putdata(green_data)
+def _shifter(data: bytes, mode: str = "bands", seed: Optional[int] = None) -> Image.Image:
+    """Shifts the RGB bands of an image, the same seed, mode and input always gives the same output"""
+    image_obj = _open(data, WORKING_SIZES["shift"]).convert("RGB")
 
-    new_blue = Image.new("L", size)
-    new_blue.putdata(blue_data)
+    pixels = np.array(image_obj)  # one writable copy, everything after is in place
+    _shift_array(pixels, mode, np.random.default_rng(seed))
 
-    new_image = Image.merge("RGB", (new_red, new_green, new_blue))
-    new_image = new_image.resize((1024, 1024))
+    return Image.fromarray(pixels, "RGB")
 
+def _loop_jpeg(data: bytes, severity: int, loops: int) -> bytes:
+    image_obj = _open(data, WORKING_SIZES["jpeg"]).convert("RGB")
     out_file = BytesIO()
-    new_image.save(out_file, format="jpeg")
-    out_file.seek(0)
-    return out_file
+    for _ in _jpeg_generations(image_obj, severity, loops, out_file):
+        pass
+    return out_file.getvalue()
+
+def _jpeg_generations(image_obj: Image.Image, severity: int, loops: int, buffer: BytesIO, deadline: Optional[float] = None) -> Iterator[Image.Image]:
+    """Re-encodes image_obj as a JPEG loops times, yielding each generation as it's decoded
+
+    The same buffer is rewritten every loop, so it holds the last generation's bytes once this is done.
+    After the first generation quality wobbles by one either side of severity, otherwise the output settles after a few generations
+    and the rest of the loops would do nothing."""
+    for loop in range(loops):
+        if deadline is not None and time.perf_counter() > deadline:
+            return
+        buffer.seek(0)
+        buffer.truncate()
+        image_obj.save(buffer, format="jpeg", quality=min(100, max(1, severity + (0, 1, -1)[loop % 3])))
+        buffer.seek(0)
+        image_obj = Image.open(buffer)
+        image_obj.load()
+        yield image_obj
+
+def _jpeg_animation(data: bytes, severity: int, loops: int, max_bytes: int = DEFAULT_TARGET_BYTES) -> bytes:
+    """Streams JPEG generations straight into an animated GIF, one frame in memory at a time
+
+    Stops early at GENERATION_TIME_BUDGET seconds or once the GIF would go over max_bytes,
+    and only every nth generation becomes a frame so there are never more than GENERATION_FRAMES."""
+    image_obj = _open(data, WORKING_SIZES["jpeg_gif"]).convert("RGB")
+    deadline = time.perf_counter() + GENERATION_TIME_BUDGET
+    every = -(-loops // GENERATION_FRAMES)
+
+    palette = image_obj.quantize(colors=256)
+    out_file = BytesIO()
+    header, _ = GifImagePlugin.getheader(palette, info={"loop": 0})
+    for chunk in header:
+        out_file.write(chunk)
 
-@lru_cache(maxsize=10)
-def _jpeg(attachment_file: BytesIO, severity: int) -> BytesIO:
-    image_obj = Image.open(attachment_file).convert("RGB")
+    for generation, frame in enumerate(_jpeg_generations(image_obj, severity, loops, BytesIO(), deadline), 1):
+        if generation % every and generation != loops:
+            continue
+        chunks = GifImagePlugin.getdata(frame.quantize(palette=palette, dither=0), duration=GENERATION_FRAME_MS)
+        if out_file.tell() + sum(map(len, chunks)) + 1 > max_bytes:
+            break
+        for chunk in chunks:
+            out_file.write(chunk)
 
-    out_file = BytesIO()
-    image_obj.save(out_file, format="jpeg", quality=severity)
-    out_file.seek(0)
-    return out_file
+    out_file.write(b";")  # gif trailer
+    return out_file.getvalue()
 
-def _loop_jpeg(attachment_file: BytesIO, severity: int, loops: int) -> BytesIO:
-    for _ in range(loops):
-        attachment_file = self._jpeg(attachment_file, severity)
-    return attachment_file
+def _diff(data_a: bytes, data_b: bytes) -> Image.Image:
 
-@lru_cache(maxsize=10)
-def _diff(file_a: BytesIO, file_a_size: Tuple[int, int], file_b: BytesIO, file_b_size: Tuple[int, int]) -> BytesIO:
+    image_obj_a = _open(data_a, WORKING_SIZES["diff"]).convert("RGB")
+    image_obj_b = _open(data_b, WORKING_SIZES["diff"]).convert("RGB")
 
-    new_width = (file_a_size[0] + file_b_size[0]) // 2
-    new_height = (file_a_size[1] + file_b_size[1]) // 2
+    new_width = (image_obj_a.width + image_obj_b.width) // 2
+    new_height = (image_obj_a.height + image_obj_b.height) // 2
 
-    image_obj_a = Image.open(file_a)
-    image_obj_a = image_obj_a.convert("RGB")
     image_obj_a = image_obj_a.resize((new_width, new_height))
-
-    image_obj_b = Image.open(file_b)
-    image_obj_b = image_obj_b.convert("RGB")
     image_obj_b = image_obj_b.resize((new_width, new_height))
 
-    new_image = ImageChops.difference(image_obj_a, image_obj_b)
-
-    out_file = BytesIO()
-    new_image.save(out_file, format="PNG")
-    out_file.seek(0)
-
-    return out_file
+    return ImageChops.difference(image_obj_a, image_obj_b)
 
-@lru_cache(maxsize=10)
-async def _get_image(ctx, index: int = 0) -> Tuple[BytesIO, str, Tuple[int, int]]:
-    attachment_file = BytesIO()
+def _invert(data: bytes) -> Image.Image:
+    # same as the pipe stage, so transparency is kept either way
+    return _run_pipeline(_open(data, WORKING_SIZES["invert"]), (("invert", ()),))
 
-    if not ctx.message.attachments:
-        await ctx.author.avatar_url_as(size=128, format="jpeg").save(
-            attachment_file
-        )
-        filename = ctx.author.display_name + ".png"
-        file_size = (128, 128)
+def _poster(data: bytes, bits: int) -> Image.Image:
+    return _run_pipeline(_open(data, WORKING_SIZES["poster"]), (("poster", (bits,)),))
 
-    else:
-        target = ctx.message.attachments[index]
-        await target.save(attachment_file)
-        filename = target.filename
-        file_size = (target.width, target.height)
+def _filter(data: bytes, filter_type: str) -> Image.Image:
+    image_obj = _open(data, WORKING_SIZES["filter"])
+    try:
+        image_obj = image_obj.filter(FILTERS[filter_type])
+    except (ValueError, NotImplementedError):
+        image_obj = image_obj.convert(mode="RGB").filter(FILTERS[filter_type])
+    return image_obj
 
-    return attachment_file, filename, file_size
+def _rotate(data: bytes, degrees: int) -> Image.Image:
+    return _open(data, WORKING_SIZES["rotate"]).rotate(angle=degrees)
 
-@lru_cache(maxsize=10)
-def _get_dimension(img_bytes: BytesIO) -> Tuple[BytesIO, int]:
-    image_obj = Image.open(img_bytes)
-    file_size = image_obj.size
-    return img_bytes, file_size
+MAX_PIPE_STAGES = 8
+Stage = Tuple[str, tuple]
 
-@lru_cache(maxsize=15)
-async def _image_ops_func(ctx, img_bytes: Tuple[BytesIO, Optional[BytesIO]]):
-    if len(ctx.message.attachments) == 1:
-        file_a, _, file_size = await self._get_image(ctx, 0)
+# point operations map each channel value to another, so runs of them fuse into a single lookup table
+POINT_STAGES = {
+    "invert": lambda: 255 - np.arange(256, dtype=np.uint8),
+    "poster": lambda bits: np.arange(256, dtype=np.uint8) & np.uint8(~(2 ** (8 - bits) - 1) & 0xff),
+}
 
-    elif img_bytes:
-        file_a, file_size = self._get_dimension(img_bytes[0])
+def _parse_stage(text: str) -> Stage:
+    """Turns something like "poster 3" into ("poster", (3,)), raising ValueError if it isn't valid"""
+    name, *args = text.split() or [""]
+    name = name.lower()
+
+    if name in ("invert", "negative"):
+        if args:
+            raise ValueError("invert doesn't take any arguments")
+        return ("invert", ())
+
+    if name == "poster":
+        bits = int(args[0]) if args else 8
+        if len(args) > 1 or not (1 <= bits <= 8):
+            raise ValueError("poster takes one number of bits between 1 and 8 inclusive")
+        return ("poster", (bits,))
+
+    if name == "filter":
+        if len(args) != 1 or args[0].lower() not in FILTERS:
+            raise ValueError(f"filter takes one of {', '.join(FILTERS)}")
+        return ("filter", (args[0].lower(),))
+
+    if name == "rotate":
+        if len(args) != 1:
+            raise ValueError("rotate takes a number of degrees")
+        return ("rotate", (int(args[0]) % 360,))
+
+    if name == "shift":
+        mode = args[0].lower() if args else "bands"
+        seed = int(args[1]) if len(args) > 1 else None
+        if len(args) > 2 or mode not in SHIFT_MODES:
+            raise ValueError(f"shift takes a mode ({', '.join(SHIFT_MODES)}) and an optional seed")
+        return ("shift", (mode, seed))
+
+    raise ValueError(f"{name or 'An empty stage'} isn't something the pipe can do")
+
+def parse_pipeline(text: str) -> Tuple[Stage, ...]:
+    """Parses and validates a chain like "invert | poster 3 | rotate 90" before any image work happens"""
+    stages = []
+    for part in text.split("|"):
+        try:
+            stages.append(_parse_stage(part))
+        except ValueError as exc:
+            if str(exc).startswith("invalid literal"):
+                raise ValueError(f"{part.strip()!r} was given something that isn't a number")
+            raise
+    if len(stages) > MAX_PIPE_STAGES:
+        raise ValueError(f"A pipe can have at most {MAX_PIPE_STAGES} stages")
+    return tuple(stages)
+
+def _is_random(stages: Tuple[Stage, ...]) -> bool:
+    return any(name == "shift" and args[1] is None for name, args in stages)
+
+def _apply_lut(image_obj: Image.Image, lut: np.ndarray) -> Image.Image:
+    table = lut.tolist()
+    if image_obj.mode == "RGBA":
+        return image_obj.point(table * 3 + list(range(256)))
+    return image_obj.point(table * len(image_obj.getbands()))
+
+def _apply_stage(image_obj: Image.Image, name: str, args: tuple) -> Image.Image:
+    if name == "filter":
+        return image_obj.filter(FILTERS[args[0]])
+    if name == "rotate":
+        return image_obj.rotate(angle=args[0])
+    if name == "shift":
+        mode, seed = args
+        pixels = np.array(image_obj)
+        if pixels.ndim == 2:
+            pixels = pixels[:, :, None]
+        _shift_array(pixels, mode, np.random.default_rng(seed))
+        return Image.fromarray(pixels.squeeze(2) if pixels.shape[2] == 1 else pixels, image_obj.mode)
+    raise ValueError(f"Unknown stage {name!r}")
+
+def _run_pipeline(image_obj: Image.Image, stages: Tuple[Stage, ...]) -> Image.Image:
+    """Applies every stage to an already decoded image, fusing back to back point operations into one lookup"""
+    if image_obj.mode not in ("RGB", "RGBA", "L"):
+        has_alpha = "A" in image_obj.getbands() or "transparency" in image_obj.info
+        image_obj = image_obj.convert("RGBA" if has_alpha else "RGB")
+
+    lut = None
+    for name, args in stages:
+        if name in POINT_STAGES:
+            stage_lut = POINT_STAGES[name](*args)
+            lut = stage_lut if lut is None else stage_lut[lut]
+            continue
+        if lut is not None:
+            image_obj = _apply_lut(image_obj, lut)
+            lut = None
+        image_obj = _apply_stage(image_obj, name, args)
+
+    if lut is not None:
+        image_obj = _apply_lut(image_obj, lut)
+    return image_obj
+
+def _pipeline(data: bytes, stages: Tuple[Stage, ...]) -> Image.Image:
+    """Decodes once and runs every stage, _render then encodes once"""
+    return _run_pipeline(_open(data, WORKING_SIZES["pipe"]), stages)
+
+EMOJI_BYTES = 256 * 1024
+EMOJI_SIZES = (128, 96, 64, 48, 32)
+EMOJI_COLOURS = (256, 128, 64, 32)
+EMOJI_FORMATS = ("png", "jpeg", "gif")
+
+def _quantize(frame: Image.Image, colours: int) -> Image.Image:
+    """A palette frame with the last index kept for see-through pixels, GIF only does on/off transparency"""
+    paletted = frame.convert("RGB").quantize(colors=colours - 1, method=Image.FASTOCTREE, dither=Image.NONE)
+    palette = (paletted.getpalette() or [])[:(colours - 1) * 3]
+    pixels = np.array(paletted)
+    pixels[np.asarray(frame.getchannel("A")) < 128] = colours - 1
+    out = Image.fromarray(pixels, "P")
+    out.putpalette(palette + [0] * (768 - len(palette)))
+    out.info["transparency"] = colours - 1
+    return out
+
+def _emoji_frames(image_obj: Image.Image, size: int) -> Tuple[list, list]:
+    """Every frame as RGBA no bigger than size, and how long each is shown for"""
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(image_obj):
+        frame = frame.convert("RGBA")
+        frame.thumbnail((size, size), Image.LANCZOS)
+        frames.append(frame)
+        durations.append(frame.info.get("duration", image_obj.info.get("duration", 100)))
+    return frames, durations
+
+def _fit_emoji(data: bytes, max_bytes: int = EMOJI_BYTES) -> Tuple[bytes, Dict[str, Any]]:
+    """Runs in a worker, shrinks an image until Discord will take it as an emoji by resizing and cutting colours,
+    frame by frame for animated GIFs. Images that already fit come back untouched."""
+    start = time.perf_counter()
+    fmt = _sniff_format(data[:12])
+    if len(data) <= max_bytes and fmt in EMOJI_FORMATS:
+        return data, {"format": fmt, "size": len(data), "encode_time": 0.0, "attempts": 0}
+
+    image_obj = Image.open(BytesIO(data))
+    animated = getattr(image_obj, "is_animated", False)
+    frames, durations = _emoji_frames(image_obj, EMOJI_SIZES[0])
+    loop = image_obj.info.get("loop", 0)
+
+    attempts = 0
+    for size in EMOJI_SIZES:
+        scaled = [frame if max(frame.size) <= size else frame.resize(
+            (max(1, frame.width * size // max(frame.size)), max(1, frame.height * size // max(frame.size))), Image.LANCZOS
+        ) for frame in frames]
+        candidates = [None] if not animated else []  # None is full colour, only static images can be PNG
+        for colours in (*candidates, *EMOJI_COLOURS):
+            attempts += 1
+            if colours is None:
+                out, fmt = _save(scaled[0], "PNG", optimize=True), "png"
+            elif not animated:
+                out, fmt = _save(_quantize(scaled[0], colours), "PNG", optimize=True), "png"
+            else:
+                paletted = [_quantize(frame, colours) for frame in scaled]
+                out_file = BytesIO()
+                paletted[0].save(out_file, format="GIF", save_all=True, append_images=paletted[1:], duration=durations,
+                                 loop=loop, disposal=2, transparency=colours - 1, optimize=False)
+                out, fmt = out_file.getvalue(), "gif"
+            if len(out) <= max_bytes:
+                return out, {"format": fmt, "size": len(out), "encode_time": time.perf_counter() - start, "attempts": attempts}
+    raise ValueError(f"Couldn't get that under {max_bytes // 1024} KB, even at {EMOJI_SIZES[-1]}px")
+
+OPERATIONS: Dict[str, Callable[..., Union[bytes, Image.Image]]] = {
+    "shift": _shifter,
+    "jpeg": _loop_jpeg,
+    "jpeg_gif": _jpeg_animation,
+    "diff": _diff,
+    "invert": _invert,
+    "poster": _poster,
+    "filter": _filter,
+    "rotate": _rotate,
+    "pipe": _pipeline,
+}
 
-    else:
-        file_a = BytesIO(
-            await ctx.author.avatar_url_as(format="png", size=128).read()
-        )
-        file_size = (128, 128)
+def _render(op: str, target_bytes: Optional[int], *args) -> Tuple[bytes, Dict[str, Any]]:
+    """Runs in the image workers, applies OPERATIONS[op] to args and encodes the result to fit target_bytes
 
-    return file_a, file_size
\ No newline at end of file
+    Operations that already give back encoded bytes (like jpeg, where the artifacts are the point) are passed through."""
+    result = OPERATIONS[op](*args)
+    if isinstance(result, bytes):
+        return result, {"format": _sniff_format(result[:12]), "size": len(result), "encode_time": 0.0, "attempts": 0}
+    return _encode(result, target_bytes)
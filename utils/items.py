@@ -0,0 +1,321 @@
+# utils/items.py
+
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+_non_word = re.compile(r"[^a-z0-9+]+")
+
+
+def normalise(name: str) -> str:
+    """Lowercases a name and flattens punctuation, "Rune_platebody (g)" and "rune platebody g" both become "rune platebody g" """
+    name = name.lower().replace("'", "")
+    return _non_word.sub(" ", name).strip()
+
+
+class Trie:
+    """A character trie of normalised names, each word ends on a node holding the item ids it names"""
+    _end = "\0"
+
+    def __init__(self):
+        self.root: Dict[str, Any] = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, word: str, item_id: int):
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        ids = node.setdefault(self._end, [])
+        if item_id not in ids:
+            ids.append(item_id)
+            self.size += 1
+
+    def get(self, word: str) -> List[int]:
+        node = self._walk(word)
+        return list(node.get(self._end, ())) if node else []
+
+    def _walk(self, word: str) -> Optional[Dict[str, Any]]:
+        node = self.root
+        for char in word:
+            node = node.get(char)
+            if node is None:
+                return None
+        return node
+
+    def prefix(self, word: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """Words starting with word, shortest first"""
+        node = self._walk(word)
+        if node is None:
+            return []
+        out = []
+        level = [(word, node)]
+        while level and len(out) < limit:
+            next_level = []
+            for text, current in level:
+                for char, child in sorted(current.items()):
+                    if char == self._end:
+                        out.extend((text, item_id) for item_id in child)
+                    else:
+                        next_level.append((text + char, child))
+            level = next_level
+        return out[:limit]
+
+    def fuzzy(self, word: str, max_distance: int = 2, limit: int = 5) -> List[Tuple[int, str, int]]:
+        """Words within max_distance edits of word as (distance, word, id), closest first
+
+        Walks the trie carrying one row of the Levenshtein table per node, so whole
+        branches are dropped as soon as every cell in the row is over max_distance."""
+        results = []
+        first_row = list(range(len(word) + 1))
+
+        def walk(node: Dict[str, Any], char: str, text: str, previous_row: List[int]):
+            row = [previous_row[0] + 1]
+            for column in range(1, len(word) + 1):
+                row.append(min(
+                    row[column - 1] + 1,
+                    previous_row[column] + 1,
+                    previous_row[column - 1] + (word[column - 1] != char),
+                ))
+            if row[-1] <= max_distance and self._end in node:
+                results.extend((row[-1], text, item_id) for item_id in node[self._end])
+            if min(row) <= max_distance:
+                for next_char, child in node.items():
+                    if next_char != self._end:
+                        walk(child, next_char, text + next_char, row)
+
+        for char, child in self.root.items():
+            if char != self._end:
+                walk(child, char, char, first_row)
+        results.sort()
+        return results[:limit]
+
+
+class ItemIndex:
+    """Every item's name, aliases and id, so resolving a name doesn't need the wiki.
+
+    Stored as a JSON file of {"items": {id: {"name": ..., "members": ..., "aliases": [...]}}},
+    build one from a dump with from_dump or `python -m utils.items dump.json index.json`.
+    """
+    def __init__(self, items: Optional[Dict[int, Dict[str, Any]]] = None):
+        self.items: Dict[int, Dict[str, Any]] = {}
+        self.trie = Trie()
+        for item_id, entry in (items or {}).items():
+            self.add(int(item_id), entry["name"], entry.get("aliases", ()), members=entry.get("members"))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item_id: int):
+        return item_id in self.items
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.items)
+
+    def name(self, item_id: int) -> Optional[str]:
+        entry = self.items.get(item_id)
+        return entry["name"] if entry else None
+
+    def add(self, item_id: int, name: str, aliases: Iterable[str] = (), members: Optional[bool] = None):
+        entry = self.items.setdefault(item_id, {"name": name, "aliases": []})
+        entry["name"] = name
+        if members is not None:
+            entry["members"] = members
+        for alias in aliases:
+            if alias not in entry["aliases"] and alias != name:
+                entry["aliases"].append(alias)
+        for spelling in (name, *entry["aliases"]):
+            self.trie.insert(normalise(spelling), item_id)
+
+    def exact(self, name: str) -> Optional[int]:
+        ids = self.trie.get(normalise(name))
+        return ids[0] if ids else None
+
+    def prefix(self, name: str, limit: int = 10) -> List[int]:
+        word = normalise(name)
+        if not word:  # everything starts with nothing
+            return []
+        seen = []
+        for _, item_id in self.trie.prefix(word, limit=limit * 2):
+            if item_id not in seen:
+                seen.append(item_id)
+        return seen[:limit]
+
+    def fuzzy(self, name: str, limit: int = 5) -> List[int]:
+        word = normalise(name)
+        if not word:
+            return []
+        max_distance = 1 if len(word) <= 4 else 2 if len(word) <= 10 else 3
+        seen = []
+        for _, _, item_id in self.trie.fuzzy(word, max_distance=max_distance, limit=limit * 2):
+            if item_id not in seen:
+                seen.append(item_id)
+        return seen[:limit]
+
+    def resolve(self, name: str) -> Optional[int]:
+        """Exact match, then the shortest name starting with it, then the closest spelling"""
+        if not normalise(name):
+            return None
+        item_id = self.exact(name)
+        if item_id is not None:
+            return item_id
+        matches = self.prefix(name, limit=1) or self.fuzzy(name, limit=1)
+        return matches[0] if matches else None
+
+    @classmethod
+    def from_dump(cls, path: str) -> 'ItemIndex':
+        """Builds an index from a dump file, any of
+
+        - the wiki prices mapping, a JSON list of {"id": ..., "name": ..., "members": ...}
+        - a JSON object of {name: id} or {id: {"name": ..., "aliases": [...]}}
+        - JSON lines, one object with at least "id" and "name" each
+        """
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            data = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+        index = cls()
+        if isinstance(data, dict):
+            data = data.get("items", data)
+        if isinstance(data, dict):
+            for key, value in data.items():
+                if isinstance(value, dict):
+                    index.add(int(key), value["name"], value.get("aliases", ()), members=value.get("members"))
+                else:
+                    index.add(int(value), key)
+        else:
+            for entry in data:
+                entry = entry.get("item", entry)
+                members = entry.get("members")
+                if isinstance(members, str):
+                    members = members == "true"
+                index.add(int(entry["id"]), entry["name"], entry.get("aliases", ()), members=members)
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> 'ItemIndex':
+        """Loads a saved index, or an empty one if there isn't one yet"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)["items"])
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"items": self.items}, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+
+class ValidIds:
+    """Which item ids the GE actually knows about, as flat numpy arrays indexed by item id.
+
+    An id is marked valid when a lookup succeeds and invalid when the GE 404s, so random picks
+    never land on a dead id twice. Prices are the last ones seen, 0 when unknown.
+    """
+    def __init__(self, size: int = 32768):
+        self.valid = np.zeros(size, dtype=bool)
+        self.members = np.zeros(size, dtype=bool)
+        self.prices = np.zeros(size, dtype=np.int64)
+        self._ids: Optional[np.ndarray] = None  # flatnonzero(valid), rebuilt lazily after changes
+
+    def __len__(self):
+        return int(self.valid.sum())
+
+    def __contains__(self, item_id: int):
+        return 0 <= item_id < self.valid.size and bool(self.valid[item_id])
+
+    def _grow(self, item_id: int):
+        if item_id < self.valid.size:
+            return
+        size = max(item_id + 1, self.valid.size * 2)
+        for attr in ("valid", "members", "prices"):
+            old = getattr(self, attr)
+            new = np.zeros(size, dtype=old.dtype)
+            new[:old.size] = old
+            setattr(self, attr, new)
+
+    def mark_valid(self, item_id: int, price: Optional[int] = None, members: Optional[bool] = None):
+        self._grow(item_id)
+        if not self.valid[item_id]:
+            self.valid[item_id] = True
+            self._ids = None
+        if price is not None:
+            self.prices[item_id] = price
+        if members is not None:
+            self.members[item_id] = members
+
+    def mark_invalid(self, item_id: int):
+        if item_id in self:
+            self.valid[item_id] = False
+            self._ids = None
+
+    @property
+    def ids(self) -> np.ndarray:
+        if self._ids is None:
+            self._ids = np.flatnonzero(self.valid)
+        return self._ids
+
+    def sample(
+        self,
+        rng: Optional[np.random.Generator] = None,
+        min_price: Optional[int] = None,
+        max_price: Optional[int] = None,
+        members: Optional[bool] = None,
+    ) -> Optional[int]:
+        """A random valid id, optionally only ones with a known price in a band or of one membership"""
+        rng = rng or np.random.default_rng()
+        ids = self.ids
+        if min_price is not None or max_price is not None or members is not None:
+            mask = np.ones(ids.size, dtype=bool)
+            prices = self.prices[ids]
+            if min_price is not None:
+                mask &= (prices > 0) & (prices >= min_price)
+            if max_price is not None:
+                mask &= (prices > 0) & (prices <= max_price)
+            if members is not None:
+                mask &= self.members[ids] == members
+            ids = ids[mask]
+        if ids.size == 0:
+            return None
+        return int(ids[rng.integers(ids.size)])
+
+    def seed_from(self, index: ItemIndex):
+        """Every id in the index is a GE item, so they start off valid"""
+        for item_id, entry in index.items.items():
+            self.mark_valid(item_id, members=entry.get("members"))
+
+    @classmethod
+    def load(cls, path: str) -> 'ValidIds':
+        table = cls()
+        if os.path.exists(path):
+            with np.load(path) as data:
+                table.valid = data["valid"]
+                table.members = data["members"]
+                table.prices = data["prices"]
+        return table
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, valid=self.valid, members=self.members, prices=self.prices)
+        os.replace(tmp, path)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m utils.items <dump file> <index file>")
+    index = ItemIndex.from_dump(sys.argv[1])
+    index.save(sys.argv[2])
+    print(f"Indexed {len(index)} items with {len(index.trie)} spellings to {sys.argv[2]}")
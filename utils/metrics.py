@@ -0,0 +1,152 @@
+# utils/metrics.py
+
+import asyncio
+from bisect import bisect_left
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# seconds, roughly doubling, the last bucket catches everything over 30s
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+class Histogram:
+    """Counts of observations in fixed buckets, cheap enough to update on every command"""
+    __slots__ = ('buckets', 'counts', 'sum', 'count', 'max')
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket the q-th observation falls in"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound if bound != float('inf') else self.max
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+def _label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+class Metrics:
+    """Command timings, event loop lag and whatever the registered gauges report.
+
+    Commands are timed in phases: converter (argument parsing and checks), handler (the command
+    body, less uploads), upload (sending files) and worker (time spent in a worker process),
+    plus the total. Gauges are callables returning a flat {name: number} dict, read when the
+    stats are shown or written out, so nothing has to push to them.
+    """
+    def __init__(self, lag_interval: float = 0.5):
+        self.commands: Dict[Tuple[str, str], Histogram] = {}
+        self.lag = Histogram()
+        self.lag_interval = lag_interval
+        self.last_lag = 0.0
+        self.gauges: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self.started = time.time()
+        self._tasks: List[asyncio.Task] = []
+
+    def observe(self, command: str, phase: str, seconds: float):
+        histogram = self.commands.get((command, phase))
+        if histogram is None:
+            histogram = self.commands[(command, phase)] = Histogram()
+        histogram.observe(seconds)
+
+    def register(self, name: str, gauge: Callable[[], Dict[str, float]]):
+        self.gauges[name] = gauge
+
+    def read_gauges(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for name, gauge in self.gauges.items():
+            try:
+                out[name] = {key: value for key, value in gauge().items() if isinstance(value, (int, float))}
+            except Exception:  # a gauge on an unloaded cog shouldn't break the rest
+                continue
+        return out
+
+    def start(self, path: Optional[str] = None, write_every: float = 60.0):
+        """Starts the loop lag monitor, and the Prometheus file writer if a path is given"""
+        self._tasks.append(asyncio.ensure_future(self._monitor_lag()))
+        if path:
+            self._tasks.append(asyncio.ensure_future(self._write_periodically(path, write_every)))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _monitor_lag(self):
+        """Sleeps for lag_interval over and over, anything past that it took to wake up is loop lag"""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            self.last_lag = max(0.0, time.perf_counter() - start - self.lag_interval)
+            self.lag.observe(self.last_lag)
+
+    async def _write_periodically(self, path: str, every: float):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(every)
+            await loop.run_in_executor(None, self.write, path, self.prometheus())
+
+    @staticmethod
+    def write(path: str, text: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)  # so a scraper never reads half a file
+
+    def _histogram_lines(self, name: str, histogram: Histogram, labels: str = '') -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {histogram.sum}')
+        lines.append(f'{name}_count{suffix} {histogram.count}')
+        return lines
+
+    def prometheus(self) -> str:
+        """Everything in the Prometheus text exposition format"""
+        lines = [
+            '# HELP bot_command_seconds Time spent in each phase of a command.',
+            '# TYPE bot_command_seconds histogram',
+        ]
+        for (command, phase), histogram in sorted(self.commands.items()):
+            lines.extend(self._histogram_lines('bot_command_seconds', histogram, f'command="{_label(command)}",phase="{phase}"'))
+        lines += ['# HELP bot_loop_lag_seconds How late the event loop woke a sleeping task.', '# TYPE bot_loop_lag_seconds histogram']
+        lines.extend(self._histogram_lines('bot_loop_lag_seconds', self.lag))
+        lines += ['# TYPE bot_uptime_seconds gauge', f'bot_uptime_seconds {time.time() - self.started:.0f}']
+
+        lines += ['# TYPE bot_gauge gauge']
+        for source, values in sorted(self.read_gauges().items()):
+            for key, value in sorted(values.items()):
+                lines.append(f'bot_gauge{{source="{_label(source)}",name="{_label(key)}"}} {float(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def slowest(self, limit: int = 5, phase: str = 'total') -> List[Tuple[str, Histogram]]:
+        """The commands with the highest p95 for a phase"""
+        found = [(command, histogram) for (command, p), histogram in self.commands.items() if p == phase]
+        return sorted(found, key=lambda item: item[1].quantile(0.95), reverse=True)[:limit]
@@ -0,0 +1,192 @@
+# utils/pins.py
+
+from datetime import timezone
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+import discord
+
+MAX_EMBEDS = 10  # per message
+MAX_EMBED_CHARS = 6000  # across every embed in a message
+
+
+def batch_embeds(embeds: Iterable[discord.Embed]) -> List[List[discord.Embed]]:
+    """Packs embeds into as few messages as Discord allows, keeping their order"""
+    batches: List[List[discord.Embed]] = []
+    size = 0
+    for embed in embeds:
+        if not batches or len(batches[-1]) == MAX_EMBEDS or size + len(embed) > MAX_EMBED_CHARS:
+            batches.append([])
+            size = 0
+        batches[-1].append(embed)
+        size += len(embed)
+    return batches
+
+
+class Checkpoints:
+    """Which pinned messages have been archived from each channel, kept in a JSON file.
+
+    It's written after every batch that goes out, so a run that fails partway through
+    picks up from the last batch sent and rerunning never posts the same pin twice.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.channels: Dict[int, Dict[str, List[int]]] = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.channels = {int(channel_id): entry for channel_id, entry in json.load(f).items()}
+
+    def archived(self, channel_id: int) -> Set[int]:
+        return set(self.channels.get(channel_id, {}).get('archived', ()))
+
+    def last(self, channel_id: int) -> Optional[int]:
+        return self.channels.get(channel_id, {}).get('last')
+
+    def mark(self, channel_id: int, message_ids: Iterable[int]):
+        entry = self.channels.setdefault(channel_id, {'last': None, 'archived': []})
+        for message_id in message_ids:
+            if message_id not in entry['archived']:
+                entry['archived'].append(message_id)
+            entry['last'] = message_id
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.channels, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+
+class PinRecord(NamedTuple):
+    message_id: int
+    channel_id: Optional[int]
+    author_id: Optional[int]
+    author: str
+    content: str
+    jump_url: str
+    created_at: float  # unix seconds
+    archived_at: Optional[float]
+    attachments: str  # newline separated urls
+
+
+_jump_url = re.compile(r"https://(?:\w+\.)?discord(?:app)?\.com/channels/\d+/(\d+)/(\d+)")
+_jump_link = re.compile(r"\n?\[Click to jump\]\([^)]*\)$")
+
+
+def record_from_message(message: discord.Message, archived_at: Optional[float] = None) -> PinRecord:
+    """A record of a pin from the original message"""
+    return PinRecord(
+        message.id, message.channel.id, message.author.id, message.author.display_name, message.content,
+        message.jump_url, message.created_at.replace(tzinfo=timezone.utc).timestamp(), archived_at,
+        '\n'.join(attachment.url for attachment in message.attachments),
+    )
+
+
+def records_from_archive(message: discord.Message) -> List[PinRecord]:
+    """Records of the pins in a message already posted to the pins channel, from their embeds alone"""
+    records = []
+    for embed in message.embeds:
+        description = embed.description or ''
+        match = _jump_url.search(description)
+        if not match:
+            continue
+        channel_id, message_id = int(match.group(1)), int(match.group(2))
+        records.append(PinRecord(
+            message_id, channel_id, None, embed.author.name or '', _jump_link.sub('', description), match.group(0),
+            discord.utils.snowflake_time(message_id).replace(tzinfo=timezone.utc).timestamp(),
+            message.created_at.replace(tzinfo=timezone.utc).timestamp(),
+            embed.image.url if embed.image else '',
+        ))
+    return records
+
+
+class PinIndex:
+    """Archived pins in SQLite with an FTS5 index over their author and content.
+
+    Writes and searches share one connection behind a lock, so they can be run in the
+    default executor when there's a lot to insert.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS pins (
+        message_id INTEGER PRIMARY KEY,
+        channel_id INTEGER,
+        author_id INTEGER,
+        author TEXT NOT NULL,
+        content TEXT NOT NULL,
+        jump_url TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        archived_at REAL,
+        attachments TEXT NOT NULL DEFAULT ''
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS pins_fts USING fts5(
+        author, content, content='pins', content_rowid='message_id', tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE TRIGGER IF NOT EXISTS pins_ai AFTER INSERT ON pins BEGIN
+        INSERT INTO pins_fts(rowid, author, content) VALUES (new.message_id, new.author, new.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS pins_ad AFTER DELETE ON pins BEGIN
+        INSERT INTO pins_fts(pins_fts, rowid, author, content) VALUES ('delete', old.message_id, old.author, old.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS pins_au AFTER UPDATE ON pins BEGIN
+        INSERT INTO pins_fts(pins_fts, rowid, author, content) VALUES ('delete', old.message_id, old.author, old.content);
+        INSERT INTO pins_fts(rowid, author, content) VALUES (new.message_id, new.author, new.content);
+    END;
+    """
+
+    def __init__(self, path: str):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.executescript(self.schema)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT count(*) FROM pins').fetchone()[0]
+
+    def add(self, records: Iterable[PinRecord]) -> int:
+        """Inserts or updates records in one transaction, what's known from the original message
+        (author id, attachments) isn't overwritten by a later backfill from the embeds"""
+        records = list(records)
+        with self._lock, self._db:
+            self._db.executemany("""
+                INSERT INTO pins VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(message_id) DO UPDATE SET
+                    author_id = coalesce(pins.author_id, excluded.author_id),
+                    archived_at = coalesce(pins.archived_at, excluded.archived_at),
+                    attachments = CASE WHEN pins.attachments = '' THEN excluded.attachments ELSE pins.attachments END
+            """, records)
+        return len(records)
+
+    @staticmethod
+    def _match(query: str) -> str:
+        """Each word quoted so punctuation can't break the FTS syntax, the last one as a prefix"""
+        words = ['"' + word.replace('"', '""') + '"' for word in query.split()]
+        if words:
+            words[-1] += '*'
+        return ' '.join(words)
+
+    def search(self, query: str, limit: int = 5) -> List[sqlite3.Row]:
+        """Best matches first, by bm25 with the content weighted over the author"""
+        match = self._match(query)
+        if not match:
+            return []
+        with self._lock:
+            return self._db.execute("""
+                SELECT pins.*, bm25(pins_fts, 0.5, 1.0) AS rank
+                FROM pins_fts JOIN pins ON pins.message_id = pins_fts.rowid
+                WHERE pins_fts MATCH ?
+                ORDER BY rank LIMIT ?
+            """, (match, limit)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
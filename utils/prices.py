@@ -0,0 +1,164 @@
+# utils/prices.py
+
+import os
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+POINT = np.dtype([('t', '<i8'), ('p', '<i8')])  # ms timestamp, price in gp
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class PriceStore:
+    """Daily GE prices kept locally, one append-only file of (timestamp, price) records per item.
+
+    The GE graph endpoint always sends the last 180 days, but only one point changes a day,
+    so the store only goes back to it when its newest point is over a day old, and only
+    appends what's newer than what it already has. History builds up past 180 days this way.
+    """
+    recheck_after = 60 * 60  # seconds to wait before asking again when the GE hasn't updated yet
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._checked: Dict[int, float] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, item_id: int) -> str:
+        return os.path.join(self.directory, f'{item_id}.bin')
+
+    def read(self, item_id: int) -> np.ndarray:
+        """Every stored point for an item, oldest first, memory mapped so nothing is copied until it's used"""
+        path = self._path(item_id)
+        if not os.path.exists(path) or os.path.getsize(path) < POINT.itemsize:
+            return np.empty(0, dtype=POINT)
+        return np.memmap(path, dtype=POINT, mode='r')
+
+    def last_timestamp(self, item_id: int) -> Optional[int]:
+        path = self._path(item_id)
+        if not os.path.exists(path) or os.path.getsize(path) < POINT.itemsize:
+            return None
+        with open(path, 'rb') as f:
+            f.seek(-POINT.itemsize, os.SEEK_END)
+            return int(np.frombuffer(f.read(POINT.itemsize), dtype=POINT)['t'][0])
+
+    def is_stale(self, item_id: int, now: Optional[float] = None) -> bool:
+        now = now or time.time()
+        if now - self._checked.get(item_id, 0) < self.recheck_after:
+            return False
+        last = self.last_timestamp(item_id)
+        return last is None or now * 1000 - last > DAY_MS
+
+    def append(self, item_id: int, timestamps: np.ndarray, prices: np.ndarray) -> int:
+        """Adds the points newer than the newest one stored, returns how many that was
+
+        Doesn't await anything, so two refreshes of the same item on the loop can't interleave."""
+        self._checked[item_id] = time.time()
+        last = self.last_timestamp(item_id)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, prices = timestamps[order], prices[order]
+        if last is not None:
+            newer = timestamps > last
+            timestamps, prices = timestamps[newer], prices[newer]
+        if not timestamps.size:
+            return 0
+
+        points = np.empty(timestamps.size, dtype=POINT)
+        points['t'] = timestamps
+        points['p'] = prices
+        with open(self._path(item_id), 'ab') as f:
+            f.write(points.tobytes())
+        return int(points.size)
+
+    def stats(self) -> Dict[str, int]:
+        files = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.bin')]
+        return {
+            'items': len(files),
+            'points': sum(entry.stat().st_size for entry in files) // POINT.itemsize,
+        }
+
+
+def parse_daily(daily: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """The GE graph endpoint's {"ms timestamp": price} dict as int64 timestamp and price arrays, oldest first"""
+    timestamps = np.fromiter(daily.keys(), dtype=np.int64, count=len(daily))
+    prices = np.fromiter(daily.values(), dtype=np.int64, count=len(daily))
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], prices[order]
+
+
+def align(series: Sequence[np.ndarray], days: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Puts several items' stored points on one grid of the last `days` days, shape (items, days)
+
+    Days without a point carry the previous price forward, days before an item's first point are NaN.
+    Returns the grid's day starts as datetime64[D] and the price matrix as float64."""
+    end = max((int(points['t'][-1]) for points in series if points.size), default=0) // DAY_MS
+    grid = np.full((len(series), days), np.nan)
+    for row, points in enumerate(series):
+        if not points.size:
+            continue
+        column = points['t'] // DAY_MS - (end - days + 1)
+        keep = (column >= 0) & (column < days)
+        grid[row, column[keep]] = points['p'][keep]
+        earlier = points['p'][column < 0]
+        if earlier.size and np.isnan(grid[row, 0]):
+            grid[row, 0] = earlier[-1]
+
+    # forward fill: index of the last filled column at or before each column, per row
+    filled = ~np.isnan(grid)
+    last = np.where(filled, np.arange(days), 0)
+    np.maximum.accumulate(last, axis=1, out=last)
+    grid = np.take_along_axis(grid, last, axis=1)
+    grid[~np.maximum.accumulate(filled, axis=1)] = np.nan
+    return np.arange(end - days + 1, end + 1).astype('datetime64[D]'), grid
+
+
+def moving_average(grid: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean over `window` days for every row at once, NaN until a full window is available"""
+    out = np.full(grid.shape, np.nan)
+    if window > grid.shape[1]:
+        return out
+    sums = np.cumsum(np.nan_to_num(grid), axis=1)
+    counts = np.cumsum(~np.isnan(grid), axis=1)
+    sums = np.concatenate([np.zeros((grid.shape[0], 1)), sums], axis=1)
+    counts = np.concatenate([np.zeros((grid.shape[0], 1)), counts], axis=1)
+    window_sums = sums[:, window:] - sums[:, :-window]
+    window_counts = counts[:, window:] - counts[:, :-window]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out[:, window - 1:] = np.where(window_counts == window, window_sums / window, np.nan)
+    return out
+
+
+def analyse(series: Sequence[np.ndarray], changes: Sequence[int] = (7, 30, 90, 180),
+            windows: Sequence[int] = (7, 30)) -> Dict[str, np.ndarray]:
+    """Price analytics for many items in one go, every value is an array with one entry per item
+
+    - last: latest price
+    - ma{n}: n day moving average as of the latest day
+    - change{n}: percent change over the last n days, or n - 1 when history starts the day after
+    - volatility: standard deviation of daily percent returns over the whole grid
+    - drawdown: largest percent fall from a running high
+    - drawdown_now: percent below the high as of the latest day
+    """
+    days = max(max(changes), max(windows)) + 1
+    _, grid = align(series, days)
+    last = grid[:, -1]
+    stats = {'last': last}
+    for window in windows:
+        stats[f'ma{window}'] = moving_average(grid, window)[:, -1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for period in changes:
+            # the GE only sends 180 points, so with no history stored a 180 day change is a day short,
+            # fall back to the day after rather than showing nothing
+            before = grid[:, -1 - period]
+            before = np.where(np.isnan(before), grid[:, -period], before)
+            stats[f'change{period}'] = (last - before) / before * 100
+        returns = np.diff(grid, axis=1) / grid[:, :-1]
+        counts = (~np.isnan(returns)).sum(axis=1)
+        means = np.nansum(returns, axis=1) / counts
+        stats['volatility'] = np.sqrt(np.nansum((returns - means[:, None]) ** 2, axis=1) / counts) * 100
+        highs = np.fmax.accumulate(grid, axis=1)
+        falls = (grid - highs) / highs * 100
+        drawdown = np.where(np.isnan(falls), np.inf, falls).min(axis=1)
+        stats['drawdown'] = np.where(np.isinf(drawdown), np.nan, drawdown)
+        stats['drawdown_now'] = falls[:, -1]
+    return stats
@@ -0,0 +1,238 @@
+# utils/workers.py
+
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import time
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from discord.ext import commands
+
+
+class QueueFull(commands.CommandError):
+    def __init__(self, depth: int):
+        self.depth = depth
+        super().__init__(f'The queue is full ({depth} jobs waiting), try again in a bit.')
+
+
+class JobTimedOut(commands.CommandError):
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        super().__init__(f'That took longer than {timeout:.0f}s so it was dropped.')
+
+
+class Job:
+    """A single unit of work waiting on, or running in, a WorkerPool"""
+    __slots__ = ('key', 'owner', 'func', 'args', 'future', 'position', 'queued_at', 'started_at', 'finished_at')
+
+    def __init__(self, key: Hashable, owner: Optional[int], func: Callable, args: Tuple[Any, ...], future: asyncio.Future):
+        self.key = key
+        self.owner = owner
+        self.func = func
+        self.args = args
+        self.future = future
+        self.position = 0
+        self.queued_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def __repr__(self):
+        return f"<class Job; func={self.func.__name__}, key={self.key}, done={self.future.done()}>"
+
+    def __await__(self):
+        return self.future.__await__()
+
+    @property
+    def wait_time(self) -> float:
+        """Seconds spent in the queue before a worker picked the job up"""
+        return (self.started_at or time.perf_counter()) - self.queued_at
+
+    @property
+    def run_time(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+
+class WorkerPool:
+    """Runs blocking jobs in a process pool behind a bounded, per-key fair queue.
+
+    Jobs are grouped by key (a guild id for the cogs) and handed to the workers
+    round robin, so one guild spamming commands can't starve the others.
+    A job that runs over `timeout` (or is cancelled while running) is failed straight away,
+    but the process itself can't be interrupted, so its dispatcher keeps the slot and doesn't
+    take another job until the function returns.
+    """
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_queued: int = 20,
+        timeout: float = 30.0,
+        initializer: Optional[Callable] = None,
+        initargs: Tuple[Any, ...] = (),
+    ):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._initializer = initializer
+        self._initargs = initargs
+        self._executor = self._new_executor()
+        self._queues: Dict[Hashable, Deque[Job]] = {}
+        self._order: Deque[Hashable] = deque()  # keys with jobs waiting, in round robin order
+        self._available: Optional[asyncio.Semaphore] = None
+        self._dispatchers = []
+        self._waits: Deque[float] = deque(maxlen=100)
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers, initializer=self._initializer, initargs=self._initargs)
+
+    def _replace_broken(self, executor: ProcessPoolExecutor):
+        """A worker process died (OOM killed, segfault), which breaks the whole pool, so start a fresh one.
+        Each dispatcher that saw it break calls this, only the first replaces it."""
+        if executor is not self._executor:
+            return
+        executor.shutdown(wait=False)
+        self._executor = self._new_executor()
+
+    def _ensure_started(self):
+        if self._dispatchers:
+            return
+        self._available = asyncio.Semaphore(0)
+        loop = asyncio.get_event_loop()
+        self._dispatchers = [loop.create_task(self._dispatch()) for _ in range(self.max_workers)]
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker, not counting cancelled ones"""
+        return sum(self.depth_for(key) for key in self._queues)
+
+    def depth_for(self, key: Hashable) -> int:
+        return sum(1 for job in self._queues.get(key, ()) if not job.future.done())
+
+    @property
+    def average_wait(self) -> float:
+        if not self._waits:
+            return 0.0
+        return sum(self._waits) / len(self._waits)
+
+    @property
+    def max_wait(self) -> float:
+        return max(self._waits, default=0.0)
+
+    def submit(self, key: Hashable, func: Callable, *args, owner: Optional[int] = None) -> Job:
+        """Queues func(*args) to run in a worker process, await the returned Job for the result.
+
+        func and args have to be picklable, so module level functions and plain data only.
+        """
+        depth = self.depth
+        if depth >= self.max_queued:
+            self.rejected += 1
+            raise QueueFull(depth)
+        self._ensure_started()
+
+        job = Job(key, owner, func, args, asyncio.get_event_loop().create_future())
+        # jobs that have to finish before this one gets a worker, 0 when one is free
+        job.position = max(0, depth + self.running - self.max_workers + 1)
+        if key not in self._queues:
+            self._queues[key] = deque()
+            self._order.append(key)
+        self._queues[key].append(job)
+        self._available.release()
+        return job
+
+    def cancel(self, key: Hashable, owner: Optional[int] = None) -> int:
+        """Cancels the waiting jobs for key, optionally only those submitted by owner"""
+        cancelled = 0
+        for job in self._queues.get(key, ()):
+            if owner is not None and job.owner != owner:
+                continue
+            if job.future.cancel():
+                cancelled += 1
+        return cancelled
+
+    def _next_job(self) -> Job:
+        key = self._order.popleft()
+        queue = self._queues[key]
+        job = queue.popleft()
+        if queue:
+            self._order.append(key)
+        else:
+            del self._queues[key]
+        return job
+
+    async def _dispatch(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self._available.acquire()
+            job = self._next_job()
+            if job.future.done():  # cancelled while it was waiting
+                continue
+
+            job.started_at = time.perf_counter()
+            self._waits.append(job.wait_time)
+            self.running += 1
+            executor = self._executor
+            try:
+                work = loop.run_in_executor(executor, job.func, *job.args)
+                done, _ = await asyncio.wait({work, job.future}, timeout=self.timeout, return_when=asyncio.FIRST_COMPLETED)
+                job.finished_at = time.perf_counter()
+
+                if job.future.done():  # cancelled while it was running
+                    pass
+                elif work not in done:
+                    self.timeouts += 1
+                    job.future.set_exception(JobTimedOut(self.timeout))
+                elif work.exception() is not None:
+                    self.failed += 1
+                    job.future.set_exception(work.exception())
+                else:
+                    self.completed += 1
+                    job.future.set_result(work.result())
+
+                # the process is still busy with a job that was given up on, so hold its slot until it returns
+                if not work.done():
+                    await asyncio.wait({work})
+                if not work.cancelled() and isinstance(work.exception(), BrokenProcessPool):
+                    self._replace_broken(executor)
+            except BrokenProcessPool as exc:  # submitting to a pool that broke under another dispatcher
+                self._replace_broken(executor)
+                self._fail(job, exc)
+            except Exception as exc:  # whatever happens the dispatcher has to keep going, or its jobs hang forever
+                self._fail(job, exc)
+            finally:
+                self.running -= 1
+
+    def _fail(self, job: Job, exc: BaseException):
+        job.finished_at = job.finished_at or time.perf_counter()
+        if not job.future.done():
+            self.failed += 1
+            job.future.set_exception(exc)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'depth': self.depth,
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'average_wait': self.average_wait,
+            'max_wait': self.max_wait,
+        }
+
+    def close(self):
+        for task in self._dispatchers:
+            task.cancel()
+        self._dispatchers = []
+        for queue in self._queues.values():
+            for job in queue:
+                job.future.cancel()
+        self._queues.clear()
+        self._order.clear()
+        self._executor.shutdown(wait=False)